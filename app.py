@@ -1,38 +1,481 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, g, has_app_context, has_request_context
+from abc import ABC, abstractmethod
+from array import array
 from datetime import timedelta
-from collections import Counter
-from datetime import datetime
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import closing, contextmanager
+from datetime import datetime, timezone
+from flask.cli import AppGroup
+from logging.handlers import RotatingFileHandler
+from urllib.request import pathname2url
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.security import generate_password_hash, check_password_hash
 import sqlite3
+import base64
+import bisect
+import click
+import cProfile
+import csv
+import gzip
+import hashlib
+import heapq
+import hmac
+import itertools
+import json
+import logging
+import math
+import multiprocessing
 import os
+import pstats
+import queue
+import random
+import re
 import secrets
+import threading
+import time
 from dotenv import load_dotenv
 import stripe
 
 # -------------------------------------------------
-# SQLite configuration single DB for users+products
+# Metrics (Prometheus text format at /metrics)
 # -------------------------------------------------
-DB_PATH = os.path.join(os.path.dirname(__file__), "store.db")
+# Seconds; shared by request, SQL and Stripe latency histograms
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Process-local counters and histograms, rendered as Prometheus text.
+
+    Each worker process keeps its own numbers; scrape every worker (or sum
+    them upstream) when running several.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}
+        self._counters = {}
+        self._histograms = {}
+
+    def describe(self, name, kind, help_text, buckets=None):
+        self._meta[name] = (kind, help_text, buckets)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram(self._meta[name][2])
+            hist.observe(value)
+
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {
+                key: (list(h.counts), h.sum, h.count) for key, h in self._histograms.items()
+            }
+        lines = []
+        for name, (kind, help_text, buckets) in self._meta.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{format_labels(labels)} {value}")
+                continue
+            for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {total}")
+                lines.append(f"{name}_count{format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+metrics = MetricsRegistry()
+metrics.describe("http_requests_total", "counter", "Requests handled, by route, method and status.")
+metrics.describe(
+    "http_request_duration_seconds", "histogram", "Request latency by route.", LATENCY_BUCKETS
+)
+metrics.describe("db_connections_acquired_total", "counter", "Pooled connections checked out.")
+metrics.describe("db_queries_total", "counter", "SQL statements executed, by route.")
+metrics.describe("db_query_seconds_total", "counter", "Time spent executing SQL, by route.")
+metrics.describe(
+    "db_queries_per_request", "histogram", "SQL statements per request.", QUERY_COUNT_BUCKETS
+)
+metrics.describe(
+    "stripe_request_duration_seconds", "histogram", "Stripe API call latency.", LATENCY_BUCKETS
+)
+metrics.describe("stripe_errors_total", "counter", "Stripe API calls that raised.")
+
+
+@contextmanager
+def stripe_timer(operation):
+    """Time a Stripe API call into the stripe_* metrics."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        metrics.inc("stripe_errors_total", operation=operation)
+        raise
+    finally:
+        metrics.observe(
+            "stripe_request_duration_seconds", time.perf_counter() - started, operation=operation
+        )
+
+
+def record_query(elapsed):
+    """Attribute one statement to the current request, or to background work."""
+    if has_request_context():
+        g.sql_queries = g.get("sql_queries", 0) + 1
+        g.sql_seconds = g.get("sql_seconds", 0.0) + elapsed
+    else:
+        metrics.inc("db_queries_total", route="(background)")
+        metrics.inc("db_query_seconds_total", elapsed, route="(background)")
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that times execute calls (not the fetches that follow)."""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record_query(time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            record_query(time.perf_counter() - started)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose cursors (including Connection.execute's) are instrumented."""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
 
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
 
-def get_db():
-    """Open a connection to the SQLite database."""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row  # rows behave like dicts
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+# -------------------------------------------------
+# SQLite configuration: one file per workload
+# -------------------------------------------------
+# Directory holding the SQLite files; point it elsewhere for benchmarks
+DATA_DIR = os.getenv("VALLEY_DATA_DIR", os.path.dirname(os.path.abspath(__file__)))
+# Pre-split single database; only read by the migrations that move its data out
+LEGACY_DB_PATH = os.path.join(DATA_DIR, "store.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_WRITE_QUEUE = os.getenv("DB_WRITE_QUEUE", "1") == "1"
+DB_WRITE_BATCH = int(os.getenv("DB_WRITE_BATCH", "64"))
+
+# Applied once when a connection is opened, not on every checkout.
+DB_PRAGMAS = (
+    f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA temp_store = MEMORY",
+)
+# Only read-write connections may switch the journal mode. WAL lets readers
+# proceed while the writer commits; NORMAL sync is durable across
+# application crashes in WAL mode and skips an fsync per commit.
+WRITER_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+)
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of SQLite connections.
+
+    At most ``size`` connections exist at once; idle ones are reused
+    most-recently-released first so their page cache stays warm. A
+    ``readonly`` pool opens its files with ``mode=ro`` so request handlers
+    cannot write to them even by accident.
+    """
+
+    def __init__(self, path, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, readonly=False, pragmas=()):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.readonly = readonly
+        self.pragmas = pragmas
+        self._reset()
+
+    def _reset(self):
+        # connections must never be shared across a fork (gunicorn --preload)
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+
+    def _connect(self):
+        if self.readonly:
+            conn = sqlite3.connect(
+                f"file:{pathname2url(self.path)}?mode=ro",
+                uri=True, check_same_thread=False, factory=InstrumentedConnection,
+            )
+        else:
+            conn = sqlite3.connect(self.path, check_same_thread=False, factory=InstrumentedConnection)
+        conn.row_factory = sqlite3.Row  # rows behave like dicts
+        for pragma in DB_PRAGMAS + (() if self.readonly else WRITER_PRAGMAS) + self.pragmas:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        """Check out a connection, opening a new one if none are idle."""
+        if self._pid != os.getpid():
+            self._reset()
+        if not self._slots.acquire(timeout=self.timeout):
+            raise RuntimeError("Timed out waiting for a database connection.")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn):
+        """Return a connection to the pool, discarding it if it is broken."""
+        if self._pid != os.getpid():
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put_nowait(conn)
+        except sqlite3.Error:
+            conn.close()
+        finally:
+            self._slots.release()
+
+    def close_all(self):
+        """Close every idle connection (checked-out ones are left alone)."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class WriteQueue:
+    """One writer thread per process that applies queued write jobs.
+
+    A job is a callable taking the writer's connection. Everything queued
+    while the previous batch was committing is applied in one transaction
+    (group commit), each job inside its own SAVEPOINT so a failing job
+    rolls back alone. Callers block on a Future until their batch commits.
+    """
+
+    def __init__(self, path, batch_size=DB_WRITE_BATCH, pragmas=()):
+        self.path = path
+        self.batch_size = batch_size
+        self.pragmas = pragmas
+        self._lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+        self._jobs = None
+
+    def _ensure_started(self):
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._jobs = queue.Queue()
+                self._thread = threading.Thread(
+                    target=self._run, name=f"sqlite-writer-{os.path.basename(self.path)}", daemon=True
+                )
+                self._thread.start()
+
+    def submit(self, job):
+        self._ensure_started()
+        future = Future()
+        self._jobs.put((job, future))
+        return future
+
+    def run(self, job):
+        """Queue a job and wait until it has been committed (or failed)."""
+        return self.submit(job).result()
+
+    def _run(self):
+        jobs = self._jobs
+        conn = sqlite3.connect(
+            self.path, isolation_level=None, check_same_thread=False, factory=InstrumentedConnection
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in DB_PRAGMAS + WRITER_PRAGMAS + self.pragmas:
+            conn.execute(pragma)
+        while True:
+            batch = [jobs.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(jobs.get_nowait())
+                except queue.Empty:
+                    break
+            self._apply(conn, batch)
+
+    def _apply(self, conn, batch):
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for job, future in batch:
+                conn.execute("SAVEPOINT job")
+                try:
+                    result = job(conn)
+                except Exception as exc:
+                    conn.execute("ROLLBACK TO job")
+                    outcomes.append((future, None, exc))
+                else:
+                    outcomes.append((future, result, None))
+                conn.execute("RELEASE job")
+            conn.execute("COMMIT")
+        except Exception as exc:
+            # BEGIN or COMMIT failed: nothing in this batch was persisted
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for _, future in batch:
+                future.set_exception(exc)
+            return
+        for future, result, exc in outcomes:
+            if exc is not None:
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
+
+
+class Database:
+    """One SQLite file: its request pool, its writer and its tuning.
+
+    ``readonly`` databases are only written by the writer thread, imports
+    and migrations; request handlers read them through ``mode=ro``
+    connections.
+    """
+
+    def __init__(self, name, filename, readonly=False, pragmas=()):
+        self.name = name
+        self.path = os.path.join(DATA_DIR, filename)
+        self.readonly = readonly
+        self.pragmas = pragmas
+        self.pool = ConnectionPool(self.path, readonly=readonly, pragmas=pragmas)
+        self.writer = WriteQueue(self.path, pragmas=pragmas)
+
+    def connect(self):
+        """Open a private read-write connection (migrations, CLI tooling)."""
+        conn = sqlite3.connect(self.path, factory=InstrumentedConnection)
+        conn.row_factory = sqlite3.Row
+        for pragma in DB_PRAGMAS + WRITER_PRAGMAS + self.pragmas:
+            conn.execute(pragma)
+        return conn
+
+
+# The catalog is read on every page and rewritten only by imports: a big page
+# cache plus memory-mapped reads. Users are small, hot point lookups. Orders and
+# carts take most of the writes, so they get their own file and write lock.
+# The order here is also the order requests take pooled connections in.
+DATABASES = {
+    "catalog": Database(
+        "catalog", "catalog.db", readonly=True,
+        pragmas=("PRAGMA cache_size = -64000", "PRAGMA mmap_size = 268435456"),
+    ),
+    "users": Database("users", "users.db", pragmas=("PRAGMA cache_size = -8000",)),
+    "orders": Database("orders", "orders.db", pragmas=("PRAGMA cache_size = -16000",)),
+}
+
+
+def get_db(name):
+    """Return the pooled connection to database ``name`` for the current context.
+
+    Connections are held until teardown, so two requests taking pools in
+    opposite orders could each wait forever for the other's connection.
+    Every database before ``name`` in DATABASES is taken first, so a
+    context always holds a prefix of that order and never waits backwards.
+    """
+    if "dbs" not in g:
+        g.dbs = {}
+    conn = g.dbs.get(name)
+    if conn is None:
+        for earlier in DATABASES:
+            if earlier not in g.dbs:
+                g.dbs[earlier] = DATABASES[earlier].pool.acquire()
+                metrics.inc("db_connections_acquired_total", database=earlier)
+            if earlier == name:
+                break
+        conn = g.dbs[name]
     return conn
 
 
+def run_write(name, job):
+    """Run ``job(conn)`` as a committed write transaction on database ``name``.
+
+    Writes go through the database's writer thread so concurrent requests
+    share commits instead of queueing on the file lock. With DB_WRITE_QUEUE=0
+    (and a writable request pool), or when a context pins a connection in
+    ``g.write_conns``, the job runs inline on that connection instead.
+    """
+    database = DATABASES[name]
+    conn = g.get("write_conns", {}).get(name) if has_app_context() else None
+    if conn is None and not DB_WRITE_QUEUE and not database.readonly:
+        conn = get_db(name)
+    if conn is None:
+        return database.writer.run(job)
+    try:
+        result = job(conn)
+        conn.commit()
+        return result
+    except Exception:
+        conn.rollback()
+        raise
+
+
 # -------------------------------------------------
 # Seed products used only if products table is empty
 # -------------------------------------------------
-VEHICLE_OPTIONS = [
-    "2010 Honda Civic",
-    "2015 Toyota Corolla",
-    "2012 Ford F-150",
-    "2014 Chevy Silverado",
-    "2016 Nissan Altima",
-]
-
 SEED_PRODUCTS = [
     {
         "id": "brakepads-ceramic-front",
@@ -127,10 +570,93 @@ SEED_PRODUCTS = [
 ]
 
 
-def init_products_table():
+# "2012 Ford F-150 – 5.0L / 3.5L (meets spec)" -> year, make, model, detail
+FITMENT_RE = re.compile(r"^\s*(\d{4})\s+(\S+)\s+(.+?)(?:\s+[–—-]\s+(.*))?\s*$")
+ENGINE_RE = re.compile(r"\b(\d\.\dL|[VI]\d{1,2})\b", re.IGNORECASE)
+POSITION_WORDS = ("front", "rear", "left", "right", "upper", "lower", "inner", "outer")
+
+
+def parse_fitment(text):
+    """Parse a free-text fitment string into structured fitment rows.
+
+    Several vehicles may be separated by ";" or "|". Each engine listed in
+    the detail becomes its own row; unparseable entries are skipped.
+    """
+    fitments = []
+    for entry in re.split(r"[;|]", text or ""):
+        match = FITMENT_RE.match(entry)
+        if not match:
+            continue
+        year, make, model, detail = match.groups()
+        detail = detail or ""
+        words = re.findall(r"[a-z]+", detail.lower())
+        position = " ".join(w for w in words if w in POSITION_WORDS)
+        engines = [e.upper() for e in ENGINE_RE.findall(detail)] or [""]
+        for engine in dict.fromkeys(engines):
+            fitments.append(
+                {
+                    "year": int(year),
+                    "make": make,
+                    "model": model.strip(),
+                    "engine": engine,
+                    "position": position,
+                }
+            )
+    return fitments
+
+
+def parse_vehicle(label):
+    """Split a vehicle label like "2012 Ford F-150" into (year, make, model)."""
+    match = FITMENT_RE.match(label or "")
+    if not match:
+        return None
+    year, make, model, _ = match.groups()
+    return int(year), make, model.strip()
+
+
+def sync_product_fitment(cur, product_id, fitment_text):
+    """Replace a product's fitment mappings with those parsed from its text."""
+    sync_products_fitment(cur, [(product_id, fitment_text)])
+
+
+def sync_products_fitment(cur, products):
+    """Replace fitment mappings for many (product_id, fitment_text) pairs at once."""
+    products = list(products)
+    links = [
+        (product_id, f["year"], f["make"], f["model"], f["engine"], f["position"])
+        for product_id, fitment_text in products
+        for f in parse_fitment(fitment_text)
+    ]
+    cur.executemany(
+        "DELETE FROM product_fitment WHERE product_id = ?",
+        [(product_id,) for product_id, _ in products],
+    )
+    cur.executemany(
+        """
+        INSERT OR IGNORE INTO fitments (year, make, model, engine, position)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        [link[1:] for link in links],
+    )
+    cur.executemany(
+        """
+        INSERT OR IGNORE INTO product_fitment (product_id, fitment_id)
+        SELECT ?, id FROM fitments
+        WHERE year = ? AND make = ? AND model = ? AND engine = ? AND position = ?
+        """,
+        links,
+    )
+
+
+# -------------------------------------------------
+# Schema migrations (tracked in PRAGMA user_version)
+# -------------------------------------------------
+# Each step runs in its own write transaction and bumps user_version, so a
+# current database costs a single PRAGMA read at startup. Steps must stay
+# idempotent: databases created before versioning start at 0 but already
+# hold some of these objects.
+def migration_products(cur):
     """Create products table if needed and seed with default parts."""
-    conn = get_db()
-    cur = conn.cursor()
     cur.execute(
         """
         CREATE TABLE IF NOT EXISTS products (
@@ -144,7 +670,6 @@ def init_products_table():
         );
         """
     )
-    conn.commit()
 
     # If empty, seed with our default products
     cur.execute("SELECT COUNT(*) AS c FROM products;")
@@ -165,16 +690,58 @@ def init_products_table():
                     p["img"],
                     p["description"],
                 ),
-        )
-        conn.commit()
+            )
 
-    conn.close()
+
+def migration_users(cur):
+    """Create users table for authentication if it doesn't exist."""
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            email TEXT NOT NULL,
+            password_hash TEXT NOT NULL,
+            display_name TEXT,
+            card_brand TEXT,
+            card_last4 TEXT,
+            card_exp TEXT,
+            preferred_vehicle TEXT,
+            ship_name TEXT,
+            ship_line1 TEXT,
+            ship_line2 TEXT,
+            ship_city TEXT,
+            ship_state TEXT,
+            ship_zip TEXT,
+            reset_token TEXT,
+            reset_token_expires TEXT
+        );
+        """
+    )
+    # add newer columns if an older DB exists
+    cur.execute("PRAGMA table_info(users);")
+    cols = {row["name"] for row in cur.fetchall()}
+    for col, col_type in [
+        ("display_name", "TEXT"),
+        ("card_brand", "TEXT"),
+        ("card_last4", "TEXT"),
+        ("card_exp", "TEXT"),
+        ("preferred_vehicle", "TEXT"),
+        ("ship_name", "TEXT"),
+        ("ship_line1", "TEXT"),
+        ("ship_line2", "TEXT"),
+        ("ship_city", "TEXT"),
+        ("ship_state", "TEXT"),
+        ("ship_zip", "TEXT"),
+        ("reset_token", "TEXT"),
+        ("reset_token_expires", "TEXT"),
+    ]:
+        if col not in cols:
+            cur.execute(f"ALTER TABLE users ADD COLUMN {col} {col_type};")
 
 
-def init_orders_table():
+def migration_orders(cur):
     """Create orders table to persist orders instead of in-memory."""
-    conn = get_db()
-    cur = conn.cursor()
     cur.execute(
         """
         CREATE TABLE IF NOT EXISTS orders (
@@ -226,87 +793,1699 @@ def init_orders_table():
         if col not in cols:
             cur.execute(f"ALTER TABLE orders ADD COLUMN {col} {col_type};")
 
-    conn.commit()
-    conn.close()
 
-def init_users_table():
-    """Create users table for authentication if it doesn't exist."""
-    conn = get_db()
-    cur = conn.cursor()
+def migration_catalog_version(cur):
+    """Single-row version counter bumped by triggers on every catalog write."""
+    # cached copies of the catalog revalidate with one cheap read of this row
     cur.execute(
         """
-        CREATE TABLE IF NOT EXISTS users (
+        CREATE TABLE IF NOT EXISTS catalog_meta (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        );
+        """
+    )
+    cur.execute("INSERT OR IGNORE INTO catalog_meta (id, version) VALUES (1, 0);")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        cur.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS products_version_{event.lower()}
+            AFTER {event} ON products
+            BEGIN
+                UPDATE catalog_meta SET version = version + 1 WHERE id = 1;
+            END;
+            """
+        )
+
+
+def migration_products_fts(cur):
+    """External-content FTS5 index over the searchable product columns."""
+    # kept in sync by triggers; rebuilt once when added to an existing database
+    fts_exists = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts';"
+    ).fetchone()
+    cur.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            name,
+            category,
+            fitment,
+            content='products',
+            content_rowid='rowid',
+            tokenize='unicode61 remove_diacritics 2'
+        );
+        """
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products
+        BEGIN
+            INSERT INTO products_fts (rowid, name, category, fitment)
+            VALUES (new.rowid, new.name, new.category, new.fitment);
+        END;
+        """
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products
+        BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name, category, fitment)
+            VALUES ('delete', old.rowid, old.name, old.category, old.fitment);
+        END;
+        """
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE ON products
+        BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name, category, fitment)
+            VALUES ('delete', old.rowid, old.name, old.category, old.fitment);
+            INSERT INTO products_fts (rowid, name, category, fitment)
+            VALUES (new.rowid, new.name, new.category, new.fitment);
+        END;
+        """
+    )
+    if not fts_exists:
+        cur.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild');")
+
+
+def migration_vehicle_fitment(cur):
+    """Create the structured fitment model and backfill it from products.fitment."""
+    existed = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'product_fitment';"
+    ).fetchone()
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS fitments (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            email TEXT NOT NULL,
-            password_hash TEXT NOT NULL,
-            display_name TEXT,
-            card_brand TEXT,
-            card_last4 TEXT,
-            card_exp TEXT,
-            preferred_vehicle TEXT,
-            ship_name TEXT,
-            ship_line1 TEXT,
-            ship_line2 TEXT,
-            ship_city TEXT,
-            ship_state TEXT,
-            ship_zip TEXT,
-            reset_token TEXT,
-            reset_token_expires TEXT
+            year INTEGER NOT NULL,
+            make TEXT NOT NULL COLLATE NOCASE,
+            model TEXT NOT NULL COLLATE NOCASE,
+            engine TEXT NOT NULL DEFAULT '' COLLATE NOCASE,
+            position TEXT NOT NULL DEFAULT '' COLLATE NOCASE,
+            UNIQUE (year, make, model, engine, position)
         );
         """
     )
-    # add newer columns if an older DB exists
-    cur.execute("PRAGMA table_info(users);")
-    cols = {row["name"] for row in cur.fetchall()}
-    for col, col_type in [
-        ("display_name", "TEXT"),
-        ("card_brand", "TEXT"),
-        ("card_last4", "TEXT"),
-        ("card_exp", "TEXT"),
-        ("preferred_vehicle", "TEXT"),
-        ("ship_name", "TEXT"),
-        ("ship_line1", "TEXT"),
-        ("ship_line2", "TEXT"),
-        ("ship_city", "TEXT"),
-        ("ship_state", "TEXT"),
-        ("ship_zip", "TEXT"),
-        ("reset_token", "TEXT"),
-        ("reset_token_expires", "TEXT"),
-    ]:
-        if col not in cols:
-            cur.execute(f"ALTER TABLE users ADD COLUMN {col} {col_type};")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS product_fitment (
+            product_id TEXT NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+            fitment_id INTEGER NOT NULL REFERENCES fitments(id) ON DELETE CASCADE,
+            PRIMARY KEY (product_id, fitment_id)
+        ) WITHOUT ROWID;
+        """
+    )
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_product_fitment_fitment
+        ON product_fitment (fitment_id, product_id);
+        """
+    )
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_fitments_vehicle
+        ON fitments (make, model, year);
+        """
+    )
+    # mapping changes affect vehicle filters, so they count as catalog writes
+    for event in ("INSERT", "DELETE"):
+        cur.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS product_fitment_version_{event.lower()}
+            AFTER {event} ON product_fitment
+            BEGIN
+                UPDATE catalog_meta SET version = version + 1 WHERE id = 1;
+            END;
+            """
+        )
+
+    # Migrate existing free-text fitment the first time the tables appear
+    if not existed:
+        rows = cur.execute("SELECT id, fitment FROM products").fetchall()
+        sync_products_fitment(cur, [(row["id"], row["fitment"]) for row in rows])
+
+
+def migration_products_keyset_index(cur):
+    """Keyset pagination walks the catalog in (name, price, id) order."""
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_products_name_price_id
+        ON products (name, price, id);
+        """
+    )
+
+
+def migration_cart_items(cur):
+    """Create the persistent cart table shared by every worker process."""
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS cart_items (
+            username TEXT NOT NULL,
+            product_id TEXT NOT NULL,
+            qty INTEGER NOT NULL CHECK (qty > 0),
+            added_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (username, product_id)
+        );
+        """
+    )
+
+
+def migration_users_indexes(cur):
+    """Indexes for per-request user lookups that were full table scans."""
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_users_email
+        ON users (email);
+        """
+    )
+    # only a handful of users hold a live token at any time
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_users_reset_token
+        ON users (reset_token) WHERE reset_token IS NOT NULL;
+        """
+    )
+
+
+def migration_orders_indexes(cur):
+    """Indexes for per-request order lookups that were full table scans."""
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_orders_username_id
+        ON orders (username, id);
+        """
+    )
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_order_items_order_id
+        ON order_items (order_id);
+        """
+    )
+
+
+def migration_catalog_updated_at(cur):
+    """Record when the catalog last changed, for HTTP Last-Modified."""
+    columns = {row["name"] for row in cur.execute("PRAGMA table_info(catalog_meta)")}
+    if "updated_at" not in columns:
+        cur.execute("ALTER TABLE catalog_meta ADD COLUMN updated_at TEXT;")
+    cur.execute("UPDATE catalog_meta SET updated_at = CURRENT_TIMESTAMP WHERE updated_at IS NULL;")
+    # the version triggers now stamp the time as well as bumping the counter
+    triggers = [("products", event) for event in ("INSERT", "UPDATE", "DELETE")]
+    triggers += [("product_fitment", event) for event in ("INSERT", "DELETE")]
+    for table, event in triggers:
+        name = f"{table}_version_{event.lower()}"
+        cur.execute(f"DROP TRIGGER IF EXISTS {name};")
+        cur.execute(
+            f"""
+            CREATE TRIGGER {name}
+            AFTER {event} ON {table}
+            BEGIN
+                UPDATE catalog_meta
+                SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+                WHERE id = 1;
+            END;
+            """
+        )
 
-    conn.commit()
-    conn.close()
+
+def migration_stripe_idempotency(cur):
+    """One order per Stripe payment, so webhook retries and reloads are harmless."""
+    columns = {row["name"] for row in cur.execute("PRAGMA table_info(orders)")}
+    if "stripe_session_id" not in columns:
+        cur.execute("ALTER TABLE orders ADD COLUMN stripe_session_id TEXT;")
+    # reloading the old success page could record one payment twice: keep
+    # the first order's stripe_pid and tag the copies so the index can build
+    cur.execute(
+        """
+        UPDATE orders
+        SET stripe_pid = stripe_pid || '#duplicate-' || id
+        WHERE stripe_pid IS NOT NULL
+          AND id > (SELECT MIN(o.id) FROM orders o WHERE o.stripe_pid = orders.stripe_pid);
+        """
+    )
+    cur.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_stripe_pid
+        ON orders (stripe_pid) WHERE stripe_pid IS NOT NULL;
+        """
+    )
+    cur.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_stripe_session_id
+        ON orders (stripe_session_id) WHERE stripe_session_id IS NOT NULL;
+        """
+    )
+
+
+def migration_checkout_snapshots(cur):
+    """Priced cart lines frozen at checkout, referenced from Stripe by id."""
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS checkout_snapshots (
+            id TEXT PRIMARY KEY,
+            username TEXT NOT NULL,
+            total_cents INTEGER NOT NULL,
+            created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS checkout_snapshot_lines (
+            snapshot_id TEXT NOT NULL REFERENCES checkout_snapshots(id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            product_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            fitment TEXT,
+            qty INTEGER NOT NULL CHECK (qty > 0),
+            unit_cents INTEGER NOT NULL,
+            PRIMARY KEY (snapshot_id, position)
+        ) WITHOUT ROWID;
+        """
+    )
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_checkout_snapshots_created_at
+        ON checkout_snapshots (created_at);
+        """
+    )
+
+
+def legacy_has_table(cur, table):
+    """True when the pre-split store.db is attached and holds ``table``."""
+    if not any(row["name"] == "legacy" for row in cur.execute("PRAGMA database_list")):
+        return False
+    return cur.execute(
+        "SELECT 1 FROM legacy.sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone() is not None
+
+
+def copy_legacy_table(cur, table, overrides=None):
+    """Copy the columns ``table`` shares with legacy.``table``; returns the row count.
+
+    ``overrides`` maps a column to the SQL expression (over ``src``) that
+    should be copied in its place.
+    """
+    if not legacy_has_table(cur, table):
+        return 0
+    overrides = overrides or {}
+    ours = [row["name"] for row in cur.execute(f"PRAGMA main.table_info({table})")]
+    theirs = {row["name"] for row in cur.execute(f"PRAGMA legacy.table_info({table})")}
+    columns = [col for col in ours if col in theirs]
+    cur.execute(
+        f"""
+        INSERT INTO main.{table} ({", ".join(columns)})
+        SELECT {", ".join(overrides.get(col, f"src.{col}") for col in columns)}
+        FROM legacy.{table} AS src
+        """
+    )
+    return cur.rowcount
+
+
+def migration_move_catalog(cur):
+    """Move the catalog out of the pre-split store.db."""
+    if not legacy_has_table(cur, "products"):
+        return
+    # the legacy catalog replaces the seed rows created by the first step
+    cur.execute("DELETE FROM products;")
+    copy_legacy_table(cur, "products")
+    rows = cur.execute("SELECT id, fitment FROM products").fetchall()
+    sync_products_fitment(cur, [(row["id"], row["fitment"]) for row in rows])
+
+
+def migration_move_users(cur):
+    """Move accounts out of the pre-split store.db."""
+    if not legacy_has_table(cur, "users"):
+        return
+    # users.db predates store.db and was never read by the app; store.db wins
+    cur.execute("DELETE FROM users;")
+    copy_legacy_table(cur, "users")
+
+
+def migration_move_orders(cur):
+    """Move orders, carts and checkout snapshots out of the pre-split store.db."""
+    # store.db may predate the Stripe de-duplication step: tag copies the same way
+    copy_legacy_table(
+        cur,
+        "orders",
+        overrides={
+            "stripe_pid": """
+                CASE WHEN src.stripe_pid IS NOT NULL
+                      AND src.id > (SELECT MIN(o.id) FROM legacy.orders o
+                                    WHERE o.stripe_pid = src.stripe_pid)
+                THEN src.stripe_pid || '#duplicate-' || src.id
+                ELSE src.stripe_pid END
+            """,
+        },
+    )
+    for table in ("order_items", "cart_items", "checkout_snapshots", "checkout_snapshot_lines"):
+        copy_legacy_table(cur, table)
+
+
+# Rows kept in catalog_changes; baked into a trigger, so changing it needs a migration
+CATALOG_CHANGES_KEPT = 100_000
+
+
+def migration_catalog_changes(cur):
+    """Log of product text changes, so each worker can update in-memory indexes."""
+    # old and new values ride along, so a reader can undo the old row's
+    # contribution without keeping its own copy of every product
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS catalog_changes (
+            seq INTEGER PRIMARY KEY,
+            product_id TEXT NOT NULL,
+            old_name TEXT,
+            old_category TEXT,
+            old_fitment TEXT,
+            new_name TEXT,
+            new_category TEXT,
+            new_fitment TEXT
+        );
+        """
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS products_changes_insert AFTER INSERT ON products
+        BEGIN
+            INSERT INTO catalog_changes (product_id, new_name, new_category, new_fitment)
+            VALUES (new.id, new.name, new.category, new.fitment);
+        END;
+        """
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS products_changes_update AFTER UPDATE ON products
+        WHEN old.name IS NOT new.name
+          OR old.category IS NOT new.category
+          OR old.fitment IS NOT new.fitment
+        BEGIN
+            INSERT INTO catalog_changes (
+                product_id, old_name, old_category, old_fitment, new_name, new_category, new_fitment
+            )
+            VALUES (new.id, old.name, old.category, old.fitment, new.name, new.category, new.fitment);
+        END;
+        """
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS products_changes_delete AFTER DELETE ON products
+        BEGIN
+            INSERT INTO catalog_changes (product_id, old_name, old_category, old_fitment)
+            VALUES (old.id, old.name, old.category, old.fitment);
+        END;
+        """
+    )
+    # readers that fall further behind than this rebuild from products instead
+    cur.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS catalog_changes_trim AFTER INSERT ON catalog_changes
+        BEGIN
+            DELETE FROM catalog_changes WHERE seq <= new.seq - {CATALOG_CHANGES_KEPT};
+        END;
+        """
+    )
+
+
+# Per database, append only: never renumber or edit a step that has shipped.
+# Numbering restarted when store.db was split; each file tracks its own
+# user_version.
+MIGRATIONS = {
+    "catalog": [
+        (1, "products table and seed catalog", migration_products),
+        (2, "catalog version counter", migration_catalog_version),
+        (3, "products full-text index", migration_products_fts),
+        (4, "structured vehicle fitment", migration_vehicle_fitment),
+        (5, "products keyset index", migration_products_keyset_index),
+        (6, "catalog last-modified timestamp", migration_catalog_updated_at),
+        (7, "move catalog from store.db", migration_move_catalog),
+        (8, "catalog change log", migration_catalog_changes),
+    ],
+    "users": [
+        (1, "users table", migration_users),
+        (2, "user lookup indexes", migration_users_indexes),
+        (3, "move users from store.db", migration_move_users),
+    ],
+    "orders": [
+        (1, "orders and order_items tables", migration_orders),
+        (2, "persistent cart table", migration_cart_items),
+        (3, "checkout snapshots", migration_checkout_snapshots),
+        (4, "order lookup indexes", migration_orders_indexes),
+        (5, "unique Stripe payment per order", migration_stripe_idempotency),
+        (6, "move orders and carts from store.db", migration_move_orders),
+    ],
+}
+SCHEMA_VERSIONS = {name: steps[-1][0] for name, steps in MIGRATIONS.items()}
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "1") == "1"
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def schema_versions():
+    """Current user_version of every database, read over private connections."""
+    versions = {}
+    for name, database in DATABASES.items():
+        with closing(database.connect()) as conn:
+            versions[name] = schema_version(conn)
+    return versions
+
+
+def migrate(on_step=None):
+    """Apply pending migrations in order; returns the (database, version) pairs applied.
+
+    BEGIN IMMEDIATE takes the write lock before re-reading the version, so
+    several workers starting at once apply each step exactly once. While a
+    database has pending steps the pre-split store.db, if present, is
+    attached as ``legacy`` for the steps that move its data.
+    """
+    applied = []
+    for name, steps in MIGRATIONS.items():
+        # the private connection also creates the file for read-only pools
+        with closing(DATABASES[name].connect()) as conn:
+            if schema_version(conn) >= steps[-1][0]:
+                continue
+            # ATTACH cannot run inside a transaction
+            if os.path.exists(LEGACY_DB_PATH):
+                conn.execute("ATTACH DATABASE ? AS legacy", (LEGACY_DB_PATH,))
+            for version, description, step in steps:
+                if version <= schema_version(conn):
+                    continue
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    if schema_version(conn) < version:
+                        step(conn.cursor())
+                        conn.execute(f"PRAGMA user_version = {version}")
+                        applied.append((name, version))
+                        if on_step:
+                            on_step(name, version, description)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+    return applied
+
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+def ensure_schema():
+    """Fast path for every process: one PRAGMA read per database when current."""
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        versions = schema_versions()
+        behind = [name for name, version in versions.items() if version < SCHEMA_VERSIONS[name]]
+        if behind:
+            if not AUTO_MIGRATE:
+                raise RuntimeError(
+                    f"Database schema out of date ({', '.join(behind)}). "
+                    "Run `flask --app app db upgrade` first."
+                )
+            migrate()
+        _schema_ready = True
 
 
 # -------------------------------------------------
 # Helpers to read products from DB
 # -------------------------------------------------
+# Seconds a worker trusts its copy of the catalog version before re-reading
+# catalog_meta; 0 re-reads on every request
+CATALOG_CHECK_INTERVAL = float(os.getenv("CATALOG_CHECK_INTERVAL", "1"))
+
+
+class CatalogCache:
+    """In-process columnar copy of the products table (see ColumnarCatalog).
+
+    The copy is revalidated against ``catalog_meta.version`` at most once per
+    request, and at most once per CATALOG_CHECK_INTERVAL seconds per process,
+    so writes from any worker or tool are picked up shortly after without a
+    restart. Rows are handed out as fresh dicts built from the columns.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._updated_at = None
+        self._checked_at = 0.0
+        self._catalog = None
+        self._derived = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _current_version(self, conn):
+        if has_request_context() and "catalog_version" in g:
+            return g.catalog_version
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < CATALOG_CHECK_INTERVAL:
+            version = self._version
+        else:
+            row = conn.execute("SELECT version FROM catalog_meta WHERE id = 1").fetchone()
+            version = row["version"] if row else 0
+            self._checked_at = now
+        if has_request_context():
+            g.catalog_version = version
+        return version
+
+    def snapshot(self):
+        """Return the ColumnarCatalog for the current catalog version."""
+        conn = get_db("catalog")
+        version = self._current_version(conn)
+        if version == self._version:
+            self.hits += 1
+            return self._catalog
+
+        with self._lock:
+            if version != self._version:
+                rows = conn.execute(
+                    """
+                    SELECT id, name, category, fitment, price, img, description
+                    FROM products ORDER BY name, price, id
+                    """
+                ).fetchall()
+                meta = conn.execute("SELECT updated_at FROM catalog_meta WHERE id = 1").fetchone()
+                self._catalog = ColumnarCatalog(rows)
+                self._updated_at = parse_db_timestamp(meta["updated_at"] if meta else None)
+                self._derived = {}
+                self._version = version
+            self.misses += 1
+            return self._catalog
+
+    def derived(self, key, build):
+        """Return a value computed from the catalog, rebuilt when it changes."""
+        self.snapshot()
+        derived = self._derived
+        if key not in derived:
+            derived[key] = build()
+        return derived[key]
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def updated_at(self):
+        return self._updated_at
+
+    def stats(self):
+        return {
+            "version": self._version,
+            "size": len(self._catalog) if self._catalog is not None else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "responses": len(self._derived.get("responses", ())),
+        }
+
+
+def parse_db_timestamp(value):
+    """Parse SQLite's CURRENT_TIMESTAMP text (UTC) into an aware datetime."""
+    if not value:
+        return None
+    return datetime.strptime(value, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+
+
+catalog_cache = CatalogCache()
+
+
+class LRUCache:
+    """Thread-safe LRU bounded by entry count and by total value size."""
+
+    def __init__(self, max_entries, max_bytes, sizeof=len):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        if self.max_entries <= 0 or size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+# Rendered shop pages for anonymous visitors, keyed on the catalog version
+# and the normalized page arguments; old versions simply age out
+SHOP_CACHE_ENTRIES = int(os.getenv("SHOP_CACHE_ENTRIES", "512"))
+SHOP_CACHE_MAX_BYTES = int(os.getenv("SHOP_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+shop_page_cache = LRUCache(SHOP_CACHE_ENTRIES, SHOP_CACHE_MAX_BYTES)
+
+
 def get_all_products():
-    conn = get_db()
+    catalog = catalog_cache.snapshot()
+    return [catalog.row(i) for i in range(len(catalog))]
+
+
+def get_product_by_id(pid: str):
+    return catalog_cache.snapshot().get(pid)
+
+
+def get_vehicle_options():
+    """Vehicle labels ("2012 Ford F-150") for every vehicle with mapped parts."""
+
+    def build():
+        rows = get_db("catalog").execute(
+            """
+            SELECT DISTINCT f.year, f.make, f.model
+            FROM fitments f
+            WHERE EXISTS (SELECT 1 FROM product_fitment pf WHERE pf.fitment_id = f.id)
+            ORDER BY f.make, f.model, f.year
+            """
+        ).fetchall()
+        return [f"{r['year']} {r['make']} {r['model']}" for r in rows]
+
+    return catalog_cache.derived("vehicle_options", build)
+
+
+def vehicle_filter_sql(vehicle, column="p.id"):
+    """Return (sql, params) restricting ``column`` to parts that fit a vehicle."""
+    parsed = parse_vehicle(vehicle)
+    if not parsed:
+        return "0", []
+    return (
+        f"""{column} IN (
+            SELECT pf.product_id
+            FROM fitments f JOIN product_fitment pf ON pf.fitment_id = f.id
+            WHERE f.year = ? AND f.make = ? AND f.model = ?
+        )""",
+        list(parsed),
+    )
+
+
+def vehicle_product_ids(vehicle):
+    """Set of product ids that fit a vehicle label (indexed lookup)."""
+    sql, params = vehicle_filter_sql(vehicle, column="id")
+    rows = get_db("catalog").execute(f"SELECT id FROM products WHERE {sql}", params).fetchall()
+    return {r["id"] for r in rows}
+
+
+# -------------------------------------------------
+# Keyset pagination over the catalog
+# -------------------------------------------------
+PAGE_SIZE = int(os.getenv("CATALOG_PAGE_SIZE", "24"))
+PAGE_SIZE_MAX = 200
+
+
+def encode_cursor(values):
+    """Opaque, URL-safe cursor for the last row of a page."""
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token, size):
+    """Inverse of encode_cursor; returns None for a missing or malformed cursor."""
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    return values
+
+
+def decode_product_cursor(token, sort="name"):
+    """decode_cursor() for a catalog cursor; None unless the types match.
+
+    Cursors are the sort key of the last row: (name, price, id) in name
+    order and (price, name, id) in the price orders.
+    """
+    values = decode_cursor(token, 3)
+    if values is None:
+        return None
+    if sort == "name":
+        name, price, product_id = values
+    else:
+        price, name, product_id = values
+    if not (isinstance(name, str) and isinstance(price, (int, float))
+            and not isinstance(price, bool) and isinstance(product_id, str)):
+        return None
+    return values
+
+
+def decode_order_cursor(token):
+    """decode_cursor() for an order-history cursor: the order id, or None."""
+    values = decode_cursor(token, 1)
+    if values is None or not isinstance(values[0], int) or isinstance(values[0], bool):
+        return None
+    return values[0]
+
+
+def fetch_products_page(after=None, limit=PAGE_SIZE, vehicle=""):
+    """Return (parts, next_cursor) for one page in stable (name, price, id) order."""
+    where, params = [], []
+    if after:
+        where.append("(p.name, p.price, p.id) > (?, ?, ?)")
+        params.extend(after)
+    if vehicle:
+        vehicle_sql, vehicle_params = vehicle_filter_sql(vehicle)
+        where.append(vehicle_sql)
+        params.extend(vehicle_params)
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+
+    rows = get_db("catalog").execute(
+        f"""
+        SELECT p.id, p.name, p.category, p.fitment, p.price, p.img, p.description
+        FROM products p
+        {where_sql}
+        ORDER BY p.name, p.price, p.id
+        LIMIT ?
+        """,
+        (*params, limit + 1),
+    ).fetchall()
+    parts = [dict(r) for r in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = parts[-1]
+        next_cursor = encode_cursor([last["name"], last["price"], last["id"]])
+    return parts, next_cursor
+
+
+# -------------------------------------------------
+# Columnar catalog: bitmap filters and sorts in memory
+# -------------------------------------------------
+def rows_mask(rows, size):
+    """Bitmap (bit i = row i) with the given row numbers set."""
+    buf = bytearray((size + 7) // 8)
+    for row in rows:
+        buf[row >> 3] |= 1 << (row & 7)
+    return int.from_bytes(buf, "little")
+
+
+def scan_mask(mask, start=0, limit=None):
+    """Return the set bit positions of ``mask`` from ``start`` up, at most ``limit``."""
+    found = []
+    if not mask or limit == 0:
+        return found
+    # one pass over 64-bit words: empty stretches cost a comparison per word
+    words = array("Q", mask.to_bytes((mask.bit_length() + 63) // 64 * 8, "little"))
+    first = start >> 6
+    for index in range(first, len(words)):
+        word = words[index]
+        if index == first:
+            word &= ~((1 << (start & 63)) - 1)
+        while word:
+            low = word & -word
+            found.append(index * 64 + low.bit_length() - 1)
+            if len(found) == limit:
+                return found
+            word ^= low
+    return found
+
+
+def intern_column(values):
+    """List of ``values`` in which equal strings share one object."""
+    seen = {}
+    return [seen.setdefault(value, value) for value in values]
+
+
+class ColumnarCatalog:
+    """Read-only, column-oriented copy of the products table.
+
+    Rows must arrive in (name, price, id) order, so a row number is also its
+    browse position. Prices sit in an ``array('d')``, categories are codes
+    into one interned list, repetitive text (fitment, image, description)
+    is interned, and filters are bitmaps held in Python ints (bit i = row
+    i): combining category, vehicle and price filters is a few big-integer
+    operations rather than a loop over every part.
+    """
+
+    FIELDS = ("id", "name", "category", "fitment", "price", "img", "description")
+    SORTS = ("name", "price_asc", "price_desc")
+    # price filters are answered from prefix bitmaps over the price order;
+    # each bucket costs n/8 bytes and more of them shrink the per-query edges
+    PRICE_BUCKETS = 128
+
+    def __init__(self, rows):
+        self.ids = [r[0] for r in rows]
+        self.names = [r[1] for r in rows]
+        self.fitments = intern_column(r[3] for r in rows)
+        self.prices = array("d", (r[4] for r in rows))
+        self.imgs = intern_column(r[5] for r in rows)
+        self.descriptions = intern_column(r[6] for r in rows)
+        size = self.size = len(self.ids)
+        # rows in id order, searched with bisect: 4 bytes a row instead of a dict entry
+        self.by_id = array("I", sorted(range(size), key=self.ids.__getitem__))
+
+        category_code = {}
+        self.category_codes = array(
+            "H", (category_code.setdefault(r[2], len(category_code)) for r in rows)
+        )
+        self.categories = list(category_code)
+        category_rows = [[] for _ in self.categories]
+        for row, code in enumerate(self.category_codes):
+            category_rows[code].append(row)
+        self.category_masks = {
+            name: rows_mask(category_rows[code], size) for name, code in category_code.items()
+        }
+        self.all = (1 << size) - 1
+
+        # rows in (price, name, id) order: the stable sort keeps browse order on ties
+        prices = self.prices
+        self.by_price = array("I", sorted(range(size), key=prices.__getitem__))
+        self.sorted_prices = array("d", (prices[i] for i in self.by_price))
+        self.price_step = max(1, -(-size // self.PRICE_BUCKETS))
+        self.price_prefix = [0]
+        buf = bytearray((size + 7) // 8)
+        for start in range(0, size, self.price_step):
+            for row in self.by_price[start:start + self.price_step]:
+                buf[row >> 3] |= 1 << (row & 7)
+            self.price_prefix.append(int.from_bytes(buf, "little"))
+
+    def __len__(self):
+        return self.size
+
+    def row(self, i):
+        return {
+            "id": self.ids[i],
+            "name": self.names[i],
+            "category": self.categories[self.category_codes[i]],
+            "fitment": self.fitments[i],
+            "price": self.prices[i],
+            "img": self.imgs[i],
+            "description": self.descriptions[i],
+        }
+
+    def row_of(self, pid):
+        """Row number of a product id, or None."""
+        pos = bisect.bisect_left(self.by_id, pid, key=self.ids.__getitem__)
+        if pos < self.size and self.ids[self.by_id[pos]] == pid:
+            return self.by_id[pos]
+        return None
+
+    def get(self, pid):
+        i = self.row_of(pid)
+        return None if i is None else self.row(i)
+
+    def category_options(self):
+        return sorted(c for c in self.categories if c)
+
+    def ids_mask(self, pids):
+        """Bitmap of the rows holding the given product ids (unknown ids are ignored)."""
+        rows = (self.row_of(pid) for pid in pids)
+        return rows_mask((row for row in rows if row is not None), self.size)
+
+    def _price_rank_prefix(self, rank):
+        """Bitmap of the ``rank`` cheapest rows."""
+        bucket = rank // self.price_step
+        mask = self.price_prefix[bucket]
+        start = bucket * self.price_step
+        if rank > start:
+            mask |= rows_mask(self.by_price[start:rank], self.size)
+        return mask
+
+    def price_mask(self, min_price=None, max_price=None):
+        lo = 0 if min_price is None else bisect.bisect_left(self.sorted_prices, min_price)
+        hi = self.size if max_price is None else bisect.bisect_right(self.sorted_prices, max_price)
+        if lo >= hi:
+            return 0
+        return self._price_rank_prefix(hi) & ~self._price_rank_prefix(lo)
+
+    def filter_mask(self, category=None, min_price=None, max_price=None, within=None):
+        """AND together the requested filters; ``within`` is a precomputed bitmap."""
+        mask = self.all if within is None else within
+        if category:
+            mask &= self.category_masks.get(category, 0)
+        if min_price is not None or max_price is not None:
+            mask &= self.price_mask(min_price, max_price)
+        return mask
+
+    def sort_key(self, i, sort):
+        if sort == "name":
+            return (self.names[i], self.prices[i], self.ids[i])
+        return (self.prices[i], self.names[i], self.ids[i])
+
+    def page(self, mask, sort="name", after=None, limit=PAGE_SIZE):
+        """Return (rows, next_cursor_values) for one page of ``mask`` in ``sort`` order.
+
+        Cursors are the sort key of the last row, as in keyset pagination,
+        already type-checked by decode_product_cursor(). Price orders walk the price permutation testing bits, unless the
+        filter is so selective that sorting its few matches is cheaper.
+        """
+        after = tuple(after) if after else None
+        key = lambda i: self.sort_key(i, sort)
+        if sort == "name":
+            start = bisect.bisect_right(range(self.size), after, key=key) if after else 0
+            rows = scan_mask(mask, start, limit + 1)
+        elif mask.bit_count() ** 2 < (limit + 1) * self.size:
+            # walking visits ~(limit + 1) * n / count rows; sorting costs ~count
+            order = sorted(scan_mask(mask), key=self.prices.__getitem__)
+            if sort == "price_desc":
+                end = bisect.bisect_left(order, after, key=key) if after else len(order)
+                rows = order[max(0, end - limit - 1):end][::-1]
+            else:
+                start = bisect.bisect_right(order, after, key=key) if after else 0
+                rows = order[start:start + limit + 1]
+        else:
+            bits = mask.to_bytes((self.size + 7) // 8, "little")
+            by_price = self.by_price
+            if sort == "price_desc":
+                rank = bisect.bisect_left(by_price, after, key=key) if after else self.size
+                ranks = range(rank - 1, -1, -1)
+            else:
+                rank = bisect.bisect_right(by_price, after, key=key) if after else 0
+                ranks = range(rank, self.size)
+            rows = []
+            for rank in ranks:
+                row = by_price[rank]
+                if bits[row >> 3] >> (row & 7) & 1:
+                    rows.append(row)
+                    if len(rows) > limit:
+                        break
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = list(self.sort_key(rows[-1], sort))
+        return rows, next_cursor
+
+
+# Vehicle bitmaps come from the indexed fitment lookup; each costs up to
+# n/8 bytes, so only the recently used ones are kept
+VEHICLE_MASK_CACHE_BYTES = int(os.getenv("VEHICLE_MASK_CACHE_BYTES", str(16 * 1024 * 1024)))
+vehicle_mask_cache = LRUCache(
+    10000, VEHICLE_MASK_CACHE_BYTES, sizeof=lambda mask: mask.bit_length() // 8 + 32
+)
+
+
+def vehicle_mask(catalog, vehicle):
+    """Bitmap of the catalog rows that fit a vehicle label."""
+    key = (catalog_cache.version, vehicle)
+    mask = vehicle_mask_cache.get(key)
+    if mask is None:
+        mask = catalog.ids_mask(vehicle_product_ids(vehicle))
+        vehicle_mask_cache.put(key, mask)
+    return mask
+
+
+def browse_catalog(vehicle="", category="", min_price=None, max_price=None,
+                   sort="name", after=None, limit=PAGE_SIZE):
+    """Return (parts, total, next_cursor) for a filtered, sorted catalog page."""
+    catalog = catalog_cache.snapshot()
+    within = vehicle_mask(catalog, vehicle) if vehicle else None
+    mask = catalog.filter_mask(category, min_price, max_price, within=within)
+    rows, next_values = catalog.page(mask, sort, after, limit)
+    next_cursor = encode_cursor(next_values) if next_values else None
+    return [catalog.row(i) for i in rows], mask.bit_count(), next_cursor
+
+
+# -------------------------------------------------
+# Full-text product search (FTS5)
+# -------------------------------------------------
+# bm25 column weights: name matches outrank category, then fitment
+SEARCH_WEIGHTS = (10.0, 4.0, 2.0)
+SEARCH_MAX_LIMIT = 100
+
+
+def fts_match_expression(query):
+    """Turn free text into an FTS5 query: every term must match as a prefix."""
+    terms = re.findall(r"\w+", (query or "").lower())
+    if not terms:
+        return None
+    return " AND ".join(f'"{term}"*' for term in terms)
+
+
+# ORDER BY for each shop sort; "name" keeps the relevance ranking for searches
+SEARCH_ORDERS = {
+    "name": "bm25(products_fts, ?, ?, ?), p.id",
+    "price_asc": "p.price, p.name, p.id",
+    "price_desc": "p.price DESC, p.name DESC, p.id DESC",
+}
+
+
+def search_where(match, vehicle="", category="", min_price=None, max_price=None):
+    """WHERE clause and params for an FTS match plus the shop's filters."""
+    where = "products_fts MATCH ?"
+    params = [match]
+    if vehicle:
+        vehicle_sql, vehicle_params = vehicle_filter_sql(vehicle)
+        where += f" AND {vehicle_sql}"
+        params.extend(vehicle_params)
+    if category:
+        where += " AND p.category = ?"
+        params.append(category)
+    if min_price is not None:
+        where += " AND p.price >= ?"
+        params.append(min_price)
+    if max_price is not None:
+        where += " AND p.price <= ?"
+        params.append(max_price)
+    return where, params
+
+
+def search_products(query, vehicle="", limit=None, offset=0,
+                    category="", min_price=None, max_price=None, sort="name"):
+    """Return (parts, total) for a ranked full-text search of the catalog."""
+    match = fts_match_expression(query)
+    if not match:
+        return [], 0
+
+    where, params = search_where(match, vehicle, category, min_price, max_price)
+    order = SEARCH_ORDERS.get(sort, SEARCH_ORDERS["name"])
+    weights = SEARCH_WEIGHTS if "bm25" in order else ()
+
+    conn = get_db("catalog")
+    total = conn.execute(
+        f"""
+        SELECT COUNT(*) AS c
+        FROM products_fts JOIN products p ON p.rowid = products_fts.rowid
+        WHERE {where}
+        """,
+        params,
+    ).fetchone()["c"]
     rows = conn.execute(
-        "SELECT id, name, category, fitment, price, img, description FROM products"
+        f"""
+        SELECT p.id, p.name, p.category, p.fitment, p.price, p.img, p.description
+        FROM products_fts JOIN products p ON p.rowid = products_fts.rowid
+        WHERE {where}
+        ORDER BY {order}
+        LIMIT ? OFFSET ?
+        """,
+        (*params, *weights, -1 if limit is None else limit, offset),
     ).fetchall()
-    conn.close()
-    return [dict(r) for r in rows]
+    return [dict(r) for r in rows], total
 
 
-def get_product_by_id(pid: str):
-    conn = get_db()
-    row = conn.execute(
-        "SELECT id, name, category, fitment, price, img, description FROM products WHERE id = ?",
-        (pid,),
-    ).fetchone()
-    conn.close()
-    return dict(row) if row else None
+# -------------------------------------------------
+# In-memory indexes fed by the catalog_changes log
+# -------------------------------------------------
+# past this many pending log rows a full rebuild is cheaper than replaying them
+CATALOG_INDEX_REBUILD_AFTER = 20_000
+
+
+class CatalogChangeIndex(ABC):
+    """Base for per-process indexes over every product's name, category and fitment.
+
+    Subclasses implement build(products) and apply(changes), list the
+    attributes build() sets in ``STATE`` and take ``self._lock`` around
+    lookups; this class keeps them in step with the catalog_changes log. A
+    worker builds its index on first use; one that later falls behind the
+    log's retention, or too far to replay, rebuilds from products in a
+    background thread and keeps answering from the index it has until the
+    new one is swapped in.
+    """
+
+    STATE = ()
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # held while a rebuild runs, so only one is ever in progress
+        self._rebuilding = threading.Lock()
+        self.seq = None
+        self._checked_at = 0.0
+        self.rebuilds = 0
+        self.changes_applied = 0
+
+    @abstractmethod
+    def build(self, products):
+        """Replace the index with one built from (name, category, fitment) rows."""
+
+    @abstractmethod
+    def apply(self, changes):
+        """Apply (old_name, old_category, old_fitment, new_name, new_category, new_fitment) rows."""
+
+    def rebuild(self, conn):
+        """Build a fresh index from ``conn`` and swap it in.
+
+        The build runs without the lookup lock; log rows written meanwhile
+        are replayed by the next catch_up().
+        """
+        fresh = type(self)()
+        # one read transaction, so the rows match the log position exactly
+        conn.execute("BEGIN")
+        try:
+            seq = conn.execute("SELECT COALESCE(MAX(seq), 0) AS seq FROM catalog_changes").fetchone()["seq"]
+            fresh.build(conn.execute("SELECT name, category, fitment FROM products"))
+        finally:
+            conn.commit()
+        with self._lock:
+            for attr in self.STATE:
+                setattr(self, attr, getattr(fresh, attr))
+            self.seq = seq
+            self.rebuilds += 1
+
+    def _rebuild_in_background(self):
+        pool = DATABASES["catalog"].pool
+        try:
+            conn = pool.acquire()
+            try:
+                self.rebuild(conn)
+            finally:
+                pool.release(conn)
+        except Exception:
+            app.logger.exception("Rebuilding %s failed", type(self).__name__)
+        finally:
+            self._rebuilding.release()
+
+    def start_rebuild(self):
+        """Rebuild on a background thread unless a rebuild is already running."""
+        if not self._rebuilding.acquire(blocking=False):
+            return
+        threading.Thread(
+            target=self._rebuild_in_background, name=f"{type(self).__name__}-rebuild", daemon=True
+        ).start()
+
+    def catch_up(self, wait=False):
+        """Apply catalog_changes rows written since the last call (or rebuild).
+
+        The first build runs on this thread, so a worker never answers from
+        an empty index; concurrent first callers wait for that one build.
+        Later rebuilds run in the background, or on this thread with
+        ``wait`` (CLI tooling that needs the index before it goes on).
+        """
+        if self.seq is None:
+            with self._rebuilding:
+                if self.seq is None:
+                    self.rebuild(get_db("catalog"))
+            return
+        if not wait and self._rebuilding.locked():
+            return
+        conn = get_db("catalog")
+        with self._lock:
+            rows = conn.execute(
+                """
+                SELECT seq, old_name, old_category, old_fitment, new_name, new_category, new_fitment
+                FROM catalog_changes
+                WHERE seq > ?
+                ORDER BY seq
+                LIMIT ?
+                """,
+                (self.seq, CATALOG_INDEX_REBUILD_AFTER + 1),
+            ).fetchall()
+            if not rows:
+                return
+            # not trimmed past our position, and little enough to replay
+            if rows[0]["seq"] == self.seq + 1 and len(rows) <= CATALOG_INDEX_REBUILD_AFTER:
+                self.apply(tuple(row)[1:] for row in rows)
+                self.seq = rows[-1]["seq"]
+                self.changes_applied += len(rows)
+                return
+        if wait:
+            with self._rebuilding:
+                self.rebuild(conn)
+        else:
+            self.start_rebuild()
+
+    def refresh(self, wait=False):
+        """catch_up() at most once per CATALOG_CHECK_INTERVAL seconds per process."""
+        now = time.monotonic()
+        if self.seq is not None and now - self._checked_at < CATALOG_CHECK_INTERVAL:
+            return
+        self.catch_up(wait)
+        self._checked_at = now
+
+    @property
+    def ready(self):
+        """False while there is no index yet or a rebuild is running."""
+        return self.seq is not None and not self._rebuilding.locked()
+
+    def stats(self):
+        return {
+            "seq": self.seq,
+            "rebuilds": self.rebuilds,
+            "rebuilding": self._rebuilding.locked(),
+            "changes_applied": self.changes_applied,
+        }
 
 
 # -------------------------------------------------
-# In-memory cart store (orders are persisted)
+# Typeahead suggestions (sorted-array prefix index)
 # -------------------------------------------------
-cart_db = {}        # {username: [product_id, product_id, ...]}
+SUGGEST_LIMIT = 8
+SUGGEST_MAX_LIMIT = 20
+# key insertions/removals per batch done in place before switching to a merge
+SUGGEST_INPLACE_EDITS = 1_000
+
+
+def suggest_key(text):
+    """Normalize text for prefix matching: lower-case words joined by one space."""
+    return " ".join(re.findall(r"\w+", (text or "").lower()))
+
+
+def suggest_terms(name, category, fitment, parse=parse_fitment):
+    """The (kind, text) suggestions one product contributes."""
+    terms = {}
+    if name:
+        terms[("part", name)] = None
+    if category:
+        terms[("category", category)] = None
+    for f in parse(fitment):
+        terms[("vehicle", f"{f['year']} {f['make']} {f['model']}")] = None
+    return list(terms)
+
+
+class SuggestIndex(CatalogChangeIndex):
+    """In-memory prefix index over part names, categories and vehicles.
+
+    Each kind is one sorted list of ``"<normalized words>\\0<text>"`` keys,
+    with one key per word start so "pads" also completes "Ceramic Brake
+    Pads". A lookup is a bisect plus a scan of at most ``limit`` matches per
+    kind. Texts are reference-counted by the products that produce them, so
+    rows from the catalog_changes log are applied in place.
+    """
+
+    KINDS = ("category", "part", "vehicle")
+    STATE = ("_keys", "_refs")
+
+    def __init__(self):
+        super().__init__()
+        self._keys = {kind: [] for kind in self.KINDS}
+        self._refs = Counter()
+
+    @staticmethod
+    def keys_for(text):
+        words = suggest_key(text).split()
+        return [" ".join(words[i:]) + "\0" + text for i in range(len(words))]
+
+    def build(self, products):
+        parsed = {}
+
+        def parse(fitment):
+            # fitment strings repeat across many parts; parse each once
+            if fitment not in parsed:
+                parsed[fitment] = parse_fitment(fitment)
+            return parsed[fitment]
+
+        refs = Counter()
+        for name, category, fitment in products:
+            refs.update(suggest_terms(name, category, fitment, parse))
+        keys = {kind: [] for kind in self.KINDS}
+        for kind, text in refs:
+            keys[kind].extend(self.keys_for(text))
+        for entries in keys.values():
+            entries.sort()
+        self._keys, self._refs = keys, refs
+
+    def apply(self, changes):
+        delta = Counter()
+        for change in changes:
+            for term in suggest_terms(*change[:3]):
+                delta[term] -= 1
+            for term in suggest_terms(*change[3:]):
+                delta[term] += 1
+
+        # only texts that appear or disappear touch the sorted lists
+        added = {kind: [] for kind in self.KINDS}
+        removed = {kind: set() for kind in self.KINDS}
+        for term, change in delta.items():
+            before = self._refs[term]
+            after = before + change
+            if after > 0:
+                self._refs[term] = after
+            else:
+                self._refs.pop(term, None)
+            if before <= 0 < after:
+                added[term[0]].extend(self.keys_for(term[1]))
+            elif after <= 0 < before:
+                removed[term[0]].update(self.keys_for(term[1]))
+
+        for kind in self.KINDS:
+            entries = self._keys[kind]
+            if len(added[kind]) + len(removed[kind]) <= SUGGEST_INPLACE_EDITS:
+                for key in removed[kind]:
+                    i = bisect.bisect_left(entries, key)
+                    if i < len(entries) and entries[i] == key:
+                        del entries[i]
+                for key in added[kind]:
+                    bisect.insort(entries, key)
+            else:
+                # each in-place edit moves the list tail; one merge pass is cheaper
+                merged = [key for key in entries if key not in removed[kind]]
+                merged.extend(added[kind])
+                merged.sort()
+                self._keys[kind] = merged
+
+    def lookup(self, prefix, limit=SUGGEST_LIMIT):
+        """Up to ``limit`` suggestions for ``prefix``: categories, then parts, then vehicles."""
+        key = suggest_key(prefix)
+        if not key:
+            return []
+        results, seen = [], set()
+        with self._lock:
+            for kind in self.KINDS:
+                entries = self._keys[kind]
+                i = bisect.bisect_left(entries, key)
+                while i < len(entries) and len(results) < limit and entries[i].startswith(key):
+                    text = entries[i].split("\0", 1)[1]
+                    if (kind, text) not in seen:
+                        seen.add((kind, text))
+                        results.append({"text": text, "kind": kind})
+                    i += 1
+        return results
+
+    def stats(self):
+        return {
+            **super().stats(),
+            "keys": {kind: len(entries) for kind, entries in self._keys.items()},
+        }
+
+
+suggest_index = SuggestIndex()
+
+
+# -------------------------------------------------
+# Typo-tolerant search (trigram index over the catalog vocabulary)
+# -------------------------------------------------
+# pg_trgm's default: less similar words are not offered as corrections
+FUZZY_MIN_SIMILARITY = 0.3
+# corrections tried per misspelled word, most similar first
+FUZZY_CANDIDATES = 4
+# fuzzy matches counted and paged through; bounds the cost on big catalogs
+FUZZY_MAX_MATCHES = 2_000
+# combinations of corrections searched, most similar first
+FUZZY_MAX_TIERS = 16
+
+
+def trigrams(word):
+    """pg_trgm-style trigrams of a lower-case word, padded as "  word "."""
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def correctable(word):
+    """Only real words get corrected; part numbers and short tokens stay exact."""
+    return 3 <= len(word) <= 32 and word.isalpha()
+
+
+def product_words(name, category, fitment):
+    """Lower-case words of a product as the FTS tokenizer splits them."""
+    return re.findall(r"\w+", f"{name or ''} {category or ''} {fitment or ''}".lower())
+
+
+class TrigramIndex(CatalogChangeIndex):
+    """Trigram index over the words of product names, categories and fitments.
+
+    Misspellings are corrected word by word against the catalog vocabulary,
+    which is far smaller than the catalog. Posting lists are keyed by
+    (trigram, trigram count of the word), so a lookup only reads the sizes
+    that could still beat the best corrections found so far. Words are
+    reference-counted by the products using them and kept current from
+    catalog_changes, like SuggestIndex texts.
+    """
+
+    STATE = ("_ids", "_words", "_free", "_postings", "_refs")
+
+    def __init__(self):
+        super().__init__()
+        self._ids = {}
+        self._words = []
+        self._free = []
+        self._postings = {}
+        self._refs = Counter()
+
+    @staticmethod
+    def words_of(name, category, fitment):
+        return {w for w in product_words(name, category, fitment) if correctable(w)}
+
+    def _add(self, word):
+        grams = trigrams(word)
+        if self._free:
+            wid = self._free.pop()
+            self._words[wid] = word
+        else:
+            wid = len(self._words)
+            self._words.append(word)
+        self._ids[word] = wid
+        for gram in grams:
+            self._postings.setdefault((gram, len(grams)), set()).add(wid)
+
+    def _remove(self, word):
+        wid = self._ids.pop(word)
+        grams = trigrams(word)
+        for gram in grams:
+            ids = self._postings[gram, len(grams)]
+            ids.discard(wid)
+            if not ids:
+                del self._postings[gram, len(grams)]
+        self._words[wid] = None
+        self._free.append(wid)
+
+    def build(self, products):
+        refs = Counter()
+        for name, category, fitment in products:
+            refs.update(self.words_of(name, category, fitment))
+        self._ids, self._words, self._free, self._postings = {}, [], [], {}
+        self._refs = refs
+        for word in refs:
+            self._add(word)
+
+    def apply(self, changes):
+        delta = Counter()
+        for change in changes:
+            delta.subtract(self.words_of(*change[:3]))
+            delta.update(self.words_of(*change[3:]))
+        for word, change in delta.items():
+            before = self._refs[word]
+            after = before + change
+            if after > 0:
+                self._refs[word] = after
+            else:
+                self._refs.pop(word, None)
+            if before <= 0 < after:
+                self._add(word)
+            elif after <= 0 < before:
+                self._remove(word)
+
+    def corrections(self, word, limit=FUZZY_CANDIDATES):
+        """[(similarity, word)] for the closest vocabulary words, best first."""
+        grams = trigrams(word)
+        size = len(grams)
+        floor = FUZZY_MIN_SIMILARITY
+        # a word of m trigrams is at most min(size, m) / max(size, m) similar
+        sizes = range(max(1, math.ceil(size * floor)), int(size / floor) + 1)
+        scored = []
+        for m in sorted(sizes, key=lambda m: -min(size, m) / max(size, m)):
+            if min(size, m) / max(size, m) < floor:
+                break
+            # reaching ``floor`` takes ``need`` shared trigrams, so any match is
+            # in one of the shortest size - need + 1 lists; the rest only count
+            need = math.ceil(floor * (size + m) / (1 + floor) - 1e-9)
+            lists = sorted((self._postings.get((gram, m), frozenset()) for gram in grams), key=len)
+            shared = Counter()
+            for ids in lists[:size - need + 1]:
+                shared.update(ids)
+            for ids in lists[size - need + 1:]:
+                shared.update(ids.intersection(shared))
+            for wid, common in shared.items():
+                if common >= need:
+                    similarity = common / (size + m - common)
+                    if similarity >= floor:
+                        scored.append((similarity, self._words[wid]))
+            if len(scored) >= limit:
+                scored = heapq.nsmallest(limit, scored, key=lambda s: (-s[0], s[1]))
+                floor = scored[-1][0]
+        return heapq.nsmallest(limit, scored, key=lambda s: (-s[0], s[1]))
+
+    def swaps(self, word):
+        """[(similarity, word)] for vocabulary words one adjacent swap away.
+
+        Swapped letters break up to four trigrams, so in short words ("betl")
+        they fall below FUZZY_MIN_SIMILARITY; checking each swap is cheap.
+        """
+        grams = trigrams(word)
+        found = []
+        for i in range(len(word) - 1):
+            swapped = word[:i] + word[i + 1] + word[i] + word[i + 2:]
+            if swapped != word and swapped in self._ids:
+                other = trigrams(swapped)
+                found.append((len(grams & other) / len(grams | other), swapped))
+        return found
+
+    def expand(self, query):
+        """[(term, {correction: similarity})] for each word of ``query``.
+
+        Words found in the catalog, and ones too short or numeric to
+        correct, get no corrections.
+        """
+        groups = []
+        with self._lock:
+            for term in re.findall(r"\w+", (query or "").lower()):
+                corrections = {}
+                if term not in self._ids and correctable(term):
+                    for similarity, word in self.corrections(term) + self.swaps(term):
+                        # the term itself is searched as a prefix already
+                        if not word.startswith(term):
+                            corrections[word] = similarity
+                groups.append((term, corrections))
+        return groups
+
+    def stats(self):
+        return {**super().stats(), "words": len(self._ids), "posting_lists": len(self._postings)}
+
+
+fuzzy_index = TrigramIndex()
+
+
+def fuzzy_search_products(query, vehicle="", limit=None, offset=0,
+                          category="", min_price=None, max_price=None, sort="name"):
+    """Return (parts, total, corrected) for a typo-tolerant search.
+
+    The fallback when search_products() finds nothing. Each query word is
+    widened to its closest vocabulary words, and every combination of
+    variants becomes a tier scored by the sum of their similarities. Parts
+    rank by the best tier they match: tiers are searched best first until
+    the page is full, so a page costs LIMIT rows however common the
+    corrected words are. Totals stop at FUZZY_MAX_MATCHES. ``corrected`` is
+    the query as spelled by the best matching tier, or None when nothing
+    matched.
+    """
+    fuzzy_index.refresh()
+    groups = fuzzy_index.expand(query)
+    variants = [
+        [(term, f'"{term}"*', 1.0), *sorted(
+            ((word, f'"{word}"', s) for word, s in corrections.items()), key=lambda v: -v[2]
+        )]
+        for term, corrections in groups
+    ]
+    # long queries full of typos: drop the weakest corrections until the
+    # combinations are few enough to rank
+    while math.prod(map(len, variants)) > FUZZY_MAX_TIERS ** 2:
+        max(variants, key=len).pop()
+    # the combination of the words as typed is what search_products() ran
+    combos = itertools.islice(itertools.product(*variants), 1, None)
+    tiers = [
+        (" ".join(word for word, _, _ in combo), "(" + " AND ".join(expr for _, expr, _ in combo) + ")")
+        for combo in heapq.nsmallest(FUZZY_MAX_TIERS, combos, key=lambda c: -sum(s for _, _, s in c))
+    ]
+    if not tiers:
+        return [], 0, None
+
+    conn = get_db("catalog")
+    source = "FROM products_fts JOIN products p ON p.rowid = products_fts.rowid"
+    wanted = min(FUZZY_MAX_MATCHES, offset + (FUZZY_MAX_MATCHES if limit is None else limit))
+
+    def matching(match, cap):
+        where, params = search_where(match, vehicle, category, min_price, max_price)
+        rows = conn.execute(f"SELECT p.rowid AS rowid {source} WHERE {where} LIMIT ?", (*params, cap))
+        return [row["rowid"] for row in rows]
+
+    def count_all():
+        where, params = search_where(
+            " OR ".join(match for _, match in tiers), vehicle, category, min_price, max_price
+        )
+        return conn.execute(
+            f"SELECT COUNT(*) AS c FROM (SELECT 1 {source} WHERE {where} LIMIT ?)",
+            (*params, FUZZY_MAX_MATCHES),
+        ).fetchone()["c"]
+
+    corrected = None
+    if sort != "name":
+        # price order over the capped match set; the first tier with a match names it
+        corrected = next((spelled for spelled, match in tiers if matching(match, 1)), None)
+        if corrected is None:
+            return [], 0, None
+        where, params = search_where(
+            " OR ".join(match for _, match in tiers), vehicle, category, min_price, max_price
+        )
+        rows = conn.execute(
+            f"""
+            SELECT * FROM (
+                SELECT p.id, p.name, p.category, p.fitment, p.price, p.img, p.description
+                {source}
+                WHERE {where}
+                LIMIT ?
+            ) p
+            ORDER BY {SEARCH_ORDERS[sort]}
+            LIMIT ? OFFSET ?
+            """,
+            (*params, FUZZY_MAX_MATCHES, max(0, wanted - offset), offset),
+        ).fetchall()
+        return [dict(r) for r in rows], count_all(), corrected
+
+    ranked, seen = [], set()
+    for spelled, match in tiers:
+        if len(ranked) >= wanted:
+            break
+        # rows already ranked by a better tier may come back again
+        for rowid in matching(match, wanted - len(ranked) + len(seen)):
+            if rowid not in seen and len(ranked) < wanted:
+                seen.add(rowid)
+                ranked.append(rowid)
+                corrected = corrected or spelled
+    if not ranked:
+        return [], 0, None
+    total = len(ranked) if len(ranked) < wanted else count_all()
+
+    page = ranked[offset:]
+    parts = {}
+    for row in conn.execute(
+        f"""
+        SELECT p.rowid AS rowid, p.id, p.name, p.category, p.fitment, p.price, p.img, p.description
+        FROM products p
+        WHERE p.rowid IN ({",".join("?" * len(page))})
+        """,
+        page,
+    ):
+        part = dict(row)
+        parts[part.pop("rowid")] = part
+    return [parts[rowid] for rowid in page], total, corrected
+
+
+def int_arg(name, default, minimum=0, maximum=None):
+    """Read a bounded integer query-string argument, falling back to default."""
+    try:
+        value = int(request.args.get(name, default))
+    except (TypeError, ValueError):
+        return default
+    value = max(minimum, value)
+    if maximum is not None:
+        value = min(maximum, value)
+    return value
+
+
+def price_arg(name):
+    """Read an optional non-negative price from the query string."""
+    try:
+        value = float(request.args.get(name, ""))
+    except ValueError:
+        return None
+    return value if value >= 0 and value != float("inf") else None
+
 
 # Load environment variables from .env if present (explicit path to project root)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -318,21 +2497,588 @@ load_dotenv(os.path.join(BASE_DIR, ".env"))
 app = Flask(__name__)
 app.secret_key = "valleyautoparts_secret_key"
 app.permanent_session_lifetime = timedelta(days=1)
+# Number of reverse proxies in front of the app that set X-Forwarded-For;
+# only then is request.remote_addr the client rather than the proxy
+TRUSTED_PROXIES = int(os.getenv("TRUSTED_PROXIES", "0"))
+if TRUSTED_PROXIES > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES)
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY")
+# Signing secret of the /stripe/webhook endpoint (whsec_...); without it the
+# success page finalizes orders itself, as in local development
+STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
 if stripe and STRIPE_SECRET_KEY:
     stripe.api_key = STRIPE_SECRET_KEY
 
-# Initialize tables on startup
-init_products_table()
-init_users_table()
-init_orders_table()
+@app.teardown_appcontext
+def release_db(exc):
+    """Hand the request's connections back to their pools."""
+    for name, conn in g.pop("dbs", {}).items():
+        DATABASES[name].pool.release(conn)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get("request_started")
+    if started is None:
+        return response
+    route = request.url_rule.rule if request.url_rule else "(unmatched)"
+    elapsed = time.perf_counter() - started
+    queries = g.get("sql_queries", 0)
+    metrics.inc(
+        "http_requests_total", route=route, method=request.method, status=response.status_code
+    )
+    metrics.observe("http_request_duration_seconds", elapsed, route=route, method=request.method)
+    metrics.observe("db_queries_per_request", queries, route=route)
+    if queries:
+        metrics.inc("db_queries_total", queries, route=route)
+        metrics.inc("db_query_seconds_total", g.sql_seconds, route=route)
+    return response
+
+
+# Check (and by default apply) schema migrations once per process, on the
+# first request rather than at import, so importing the app stays cheap
+@app.before_request
+def check_schema():
+    ensure_schema()
+
+
+db_cli = AppGroup("db", help="Inspect and apply schema migrations.")
+
+
+@db_cli.command("status")
+def db_status():
+    """Show each database's schema version and any pending migrations."""
+    for name, current in schema_versions().items():
+        click.echo(
+            f"{DATABASES[name].path}: schema version {current} (latest {SCHEMA_VERSIONS[name]})"
+        )
+        for version, description, _ in MIGRATIONS[name]:
+            if version > current:
+                click.echo(f"  pending {version}: {description}")
+
+
+@db_cli.command("upgrade")
+def db_upgrade():
+    """Apply pending migrations (run before deploying new workers)."""
+    applied = migrate(
+        on_step=lambda name, version, description: click.echo(
+            f"applied {name} {version}: {description}"
+        )
+    )
+    if not applied:
+        click.echo("Schemas already up to date.")
+
+
+def capture_hot_path_sql():
+    """Run the storefront's hot-path helpers and return the SQL they issue.
+
+    Everything runs against in-memory copies of the databases, so the
+    users, carts and orders created along the way are thrown away. Returns
+    (database, sql, plan) triples.
+    """
+    # warm the catalog caches first: their reloads scan by design
+    catalog_cache.snapshot()
+    get_vehicle_options()
+    suggest_index.refresh(wait=True)
+    fuzzy_index.refresh(wait=True)
+
+    statements = []
+    scratches = {}
+    for name in DATABASES:
+        scratch = scratches[name] = sqlite3.connect(":memory:", check_same_thread=False)
+        get_db(name).backup(scratch)
+        scratch.row_factory = sqlite3.Row
+        scratch.set_trace_callback(lambda sql, name=name: statements.append((name, sql)))
+    pooled = g.pop("dbs")
+    g.dbs = dict(scratches)
+    g.write_conns = scratches
+    try:
+        username, email = "explain-check", "explain-check@example.com"
+        register_user(username, email, "explain-check")
+        authenticate(username, "explain-check")
+        get_user(username)
+        update_user_profile(username, email, username, None, None, None, None)
+        validate_reset_token(set_reset_token(email))
+        clear_reset_token(username)
+
+        vehicles = get_vehicle_options()
+        vehicle = vehicles[0] if vehicles else "2010 Honda Civic"
+        page, cursor = fetch_products_page(limit=2)
+        fetch_products_page(decode_product_cursor(cursor), limit=2, vehicle=vehicle)
+        search_products("filter", vehicle, limit=5)
+        suggest_index.catch_up()
+        fuzzy_search_products("filtre", vehicle, limit=5)
+        fuzzy_index.catch_up()
+        vehicle_product_ids(vehicle)
+
+        for part in page:
+            add_item_to_cart(username, part["id"])
+            add_item_to_cart(username, part["id"])
+        if page:
+            decrement_cart_item(username, page[0]["id"])
+            remove_item_from_cart(username, page[-1]["id"])
+        snapshot_id = create_checkout_snapshot(username, price_cart(get_cart(username)))
+        create_order(username, load_checkout_snapshot(snapshot_id)[1])
+        find_order_by_checkout_session("cs_explain_check")
+        orders_page, _ = fetch_orders(username, limit=1)
+        if orders_page:
+            fetch_orders(username, before=orders_page[0]["order_id"] + 1)
+        clear_cart(username)
+    finally:
+        for scratch in scratches.values():
+            scratch.set_trace_callback(None)
+        g.pop("write_conns")
+        g.dbs = pooled
+
+    plans = []
+    seen = set()
+    for name, sql in statements:
+        head = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ""
+        if head not in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH") or sql in seen:
+            continue
+        if "'main'." in sql:
+            continue  # FTS5 reading its own shadow tables
+
+        seen.add(sql)
+        rows = scratches[name].execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+        plans.append((name, sql, [row["detail"] for row in rows]))
+    for scratch in scratches.values():
+        scratch.close()
+    return plans
+
+
+def is_table_scan(sql, detail):
+    """True for plan steps that read a whole table or index.
+
+    FTS lookups are fine, and so is walking an index in order under a LIMIT
+    (the first page of a keyset listing).
+    """
+    if not detail.startswith("SCAN ") or "VIRTUAL TABLE" in detail:
+        return False
+    return not (" INDEX " in detail and " LIMIT " in f" {sql.upper()} ")
+
+
+@db_cli.command("explain")
+@click.option("--verbose", "-v", is_flag=True, help="Print every plan, not just failures.")
+def db_explain(verbose):
+    """EXPLAIN QUERY PLAN every hot-path query; exit 1 if any falls back to a SCAN."""
+    ensure_schema()
+    failures = 0
+    for name, sql, details in capture_hot_path_sql():
+        scans = [d for d in details if is_table_scan(sql, d)]
+        failures += bool(scans)
+        if scans or verbose:
+            click.echo(("FAIL " if scans else "ok   ") + f"[{name}] " + " ".join(sql.split()))
+            for detail in details:
+                click.echo(f"       {detail}")
+    if failures:
+        click.echo(f"{failures} hot-path queries scan a table.", err=True)
+        raise SystemExit(1)
+    click.echo("All hot-path queries use an index.")
+
+
+app.cli.add_command(db_cli)
+
+
+# -------------------------------------------------
+# Bulk catalog import/export
+# -------------------------------------------------
+CATALOG_FIELDS = ("id", "name", "category", "fitment", "price", "img", "description")
+CATALOG_FORMATS = ("csv", "jsonl")
+IMPORT_BATCH_SIZE = 5000
+IMPORT_MAX_ERRORS_SHOWN = 20
+
+
+def catalog_format(path, fmt):
+    """Pick the file format from --format or the file extension."""
+    if fmt:
+        return fmt
+    ext = os.path.splitext(path)[1].lower().lstrip(".")
+    if ext in ("json", "ndjson"):
+        return "jsonl"
+    if ext in CATALOG_FORMATS:
+        return ext
+    raise click.UsageError(f"Cannot tell the format of {path!r}; pass --format.")
+
+
+def read_catalog_rows(stream, fmt):
+    """Yield (line_number, raw_row) from a CSV or JSONL stream, one at a time."""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as exc:
+            yield line_number, ValueError(f"invalid JSON: {exc}")
+            continue
+        yield line_number, row
+
+
+def validate_catalog_row(row):
+    """Return the row as a products tuple in CATALOG_FIELDS order, or raise ValueError."""
+    if isinstance(row, Exception):
+        raise row
+    if not isinstance(row, dict):
+        raise ValueError("expected an object")
+
+    def text(field):
+        value = row.get(field)
+        if value is None:
+            return None
+        value = str(value).strip()
+        return value or None
+
+    product_id = text("id")
+    name = text("name")
+    if not product_id:
+        raise ValueError("missing id")
+    if not name:
+        raise ValueError("missing name")
+    try:
+        price = float(row.get("price"))
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid price {row.get('price')!r}")
+    if not 0 <= price < float("inf"):
+        raise ValueError(f"invalid price {row.get('price')!r}")
+
+    return (
+        product_id,
+        name,
+        text("category"),
+        text("fitment"),
+        round(price, 2),
+        text("img"),
+        text("description"),
+    )
+
+
+def upsert_products(conn, rows):
+    """Insert or update a batch of validated product tuples and their fitment."""
+    conn.executemany(
+        """
+        INSERT INTO products (id, name, category, fitment, price, img, description)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (id) DO UPDATE SET
+            name = excluded.name,
+            category = excluded.category,
+            fitment = excluded.fitment,
+            price = excluded.price,
+            img = excluded.img,
+            description = excluded.description
+        """,
+        rows,
+    )
+    sync_products_fitment(conn, [(row[0], row[3]) for row in rows])
+
+
+catalog_cli = AppGroup("catalog", help="Bulk import and export the product catalog.")
+
+
+@catalog_cli.command("import")
+@click.argument("source", type=click.File("r", encoding="utf-8-sig", lazy=False))
+@click.option("--format", "fmt", type=click.Choice(CATALOG_FORMATS), help="Defaults to the file extension.")
+@click.option("--batch-size", default=IMPORT_BATCH_SIZE, show_default=True, help="Rows per transaction.")
+@click.option("--dry-run", is_flag=True, help="Validate only; write nothing.")
+def catalog_import(source, fmt, batch_size, dry_run):
+    """Upsert products from a CSV or JSONL file ("-" for stdin).
+
+    Rows are streamed and validated one at a time; valid rows are written
+    in batches, each batch in its own transaction. Invalid rows are
+    reported and skipped.
+    """
+    ensure_schema()
+    fmt = catalog_format(source.name, fmt)
+    started = time.perf_counter()
+    imported = 0
+    errors = 0
+    batch = []
+
+    def flush():
+        nonlocal imported
+        if not dry_run:
+            run_write("catalog", lambda conn: upsert_products(conn, batch))
+        imported += len(batch)
+        elapsed = time.perf_counter() - started
+        click.echo(f"  {imported} rows ({imported / elapsed:,.0f} rows/s)", err=True)
+        batch.clear()
+
+    for line_number, raw in read_catalog_rows(source, fmt):
+        try:
+            batch.append(validate_catalog_row(raw))
+        except ValueError as exc:
+            errors += 1
+            if errors <= IMPORT_MAX_ERRORS_SHOWN:
+                click.echo(f"  line {line_number}: {exc}", err=True)
+            continue
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    elapsed = time.perf_counter() - started
+    verb = "Validated" if dry_run else "Imported"
+    click.echo(
+        f"{verb} {imported} rows in {elapsed:.1f}s "
+        f"({imported / max(elapsed, 1e-9):,.0f} rows/s); skipped {errors} invalid rows."
+    )
+    if errors:
+        raise SystemExit(1)
+
+
+@catalog_cli.command("export")
+@click.argument("dest", type=click.File("w", encoding="utf-8"), default="-")
+@click.option("--format", "fmt", type=click.Choice(CATALOG_FORMATS), help="Defaults to the file extension.")
+def catalog_export(dest, fmt):
+    """Stream the catalog to a CSV or JSONL file (stdout by default)."""
+    ensure_schema()
+    fmt = fmt or ("jsonl" if dest.name == "<stdout>" else catalog_format(dest.name, None))
+    rows = get_db("catalog").execute(
+        f"SELECT {', '.join(CATALOG_FIELDS)} FROM products ORDER BY id"
+    )
+    if fmt == "csv":
+        writer = csv.writer(dest, lineterminator="\n")
+        writer.writerow(CATALOG_FIELDS)
+        writer.writerows(tuple(row) for row in rows)
+    else:
+        for row in rows:
+            dest.write(json.dumps(dict(row), ensure_ascii=False) + "\n")
+
+
+app.cli.add_command(catalog_cli)
+
+
+stripe_cli = AppGroup("stripe", help="Stripe webhook helpers.")
+
+
+@stripe_cli.command("send-event")
+@click.argument("event_file", type=click.File("r", encoding="utf-8"))
+def stripe_send_event(event_file):
+    """Sign a Stripe event JSON with STRIPE_WEBHOOK_SECRET and deliver it locally."""
+    if not STRIPE_WEBHOOK_SECRET:
+        raise click.UsageError("Set STRIPE_WEBHOOK_SECRET first.")
+    payload = event_file.read()
+    response = app.test_client().post(
+        "/stripe/webhook",
+        data=payload,
+        content_type="application/json",
+        headers={"Stripe-Signature": sign_webhook_payload(payload, STRIPE_WEBHOOK_SECRET)},
+    )
+    click.echo(f"{response.status_code} {response.get_data(as_text=True).strip()}")
+
+
+app.cli.add_command(stripe_cli)
+
+
+# -------------------------------------------------
+# Opt-in request profiling and slow-request log
+# -------------------------------------------------
+# Off by default. PROFILE_SAMPLE_RATE=0.01 runs cProfile on 1% of requests;
+# SLOW_REQUEST_MS=500 logs every request slower than that (with its profile
+# when it was also sampled). Records go to a rotating JSONL file.
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+PROFILE_LOG_PATH = os.getenv("PROFILE_LOG_PATH", os.path.join(os.path.dirname(__file__), "profiles.jsonl"))
+PROFILE_LOG_MAX_BYTES = int(os.getenv("PROFILE_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+PROFILE_LOG_BACKUPS = int(os.getenv("PROFILE_LOG_BACKUPS", "5"))
+PROFILE_FUNCTIONS_KEPT = 40
+
+profile_log = logging.getLogger("valley.profile")
+profile_log.propagate = False
+profile_log_lock = threading.Lock()
+# cProfile hooks the whole interpreter: only one request is profiled at a time
+profiler_lock = threading.Lock()
+
+
+def profile_logging_enabled():
+    return PROFILE_SAMPLE_RATE > 0 or SLOW_REQUEST_MS > 0
+
+
+def write_profile_record(record):
+    """Append one JSON record, opening the rotating log on first use."""
+    if not profile_log.handlers:
+        with profile_log_lock:
+            if not profile_log.handlers:
+                handler = RotatingFileHandler(
+                    PROFILE_LOG_PATH, maxBytes=PROFILE_LOG_MAX_BYTES, backupCount=PROFILE_LOG_BACKUPS
+                )
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                profile_log.setLevel(logging.INFO)
+                profile_log.addHandler(handler)
+    profile_log.info(json.dumps(record, separators=(",", ":")))
+
+
+def summarize_profile(profiler):
+    """The hottest functions of a profile, by own time and by cumulative time."""
+    stats = pstats.Stats(profiler).stats
+    rows = [
+        {
+            "function": pstats.func_std_string(func),
+            "calls": calls,
+            "tottime": round(tottime, 6),
+            "cumtime": round(cumtime, 6),
+        }
+        for func, (_, calls, tottime, cumtime, _) in stats.items()
+    ]
+    keep = PROFILE_FUNCTIONS_KEPT // 2
+    by_own = sorted(rows, key=lambda r: r["tottime"], reverse=True)[:keep]
+    by_cumulative = sorted(rows, key=lambda r: r["cumtime"], reverse=True)[:keep]
+    return list({r["function"]: r for r in by_own + by_cumulative}.values())
+
+
+@app.before_request
+def start_profiler():
+    """Profile this request if it is sampled and no other request is profiled.
+
+    A sampled request that finds the profiler busy simply goes unprofiled.
+    """
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        if not profiler_lock.acquire(blocking=False):
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # another profiling tool is already active in this process
+            profiler_lock.release()
+            return
+        g.profiler = profiler
+
+
+def stop_profiler():
+    """Disable and return the request's profiler, if it was sampled."""
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+        profiler_lock.release()
+    return profiler
+
+
+@app.teardown_request
+def release_profiler(exc):
+    # after_request is skipped when the request raised; don't leak the lock
+    stop_profiler()
+
+
+@app.after_request
+def log_profile(response):
+    profiler = stop_profiler()
+    if not profile_logging_enabled() or "request_started" not in g:
+        return response
+
+    duration_ms = (time.perf_counter() - g.request_started) * 1000
+    slow = SLOW_REQUEST_MS > 0 and duration_ms >= SLOW_REQUEST_MS
+    if profiler is None and not slow:
+        return response
+    write_profile_record(
+        {
+            "ts": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "kind": "slow" if slow else "sample",
+            "route": request.url_rule.rule if request.url_rule else "(unmatched)",
+            "method": request.method,
+            "path": request.path,
+            "args": request.args.to_dict(flat=False),
+            "status": response.status_code,
+            "duration_ms": round(duration_ms, 3),
+            "queries": g.get("sql_queries", 0),
+            "sql_ms": round(g.get("sql_seconds", 0.0) * 1000, 3),
+            "functions": summarize_profile(profiler) if profiler is not None else None,
+        }
+    )
+    return response
+
+
+def read_profile_records(paths):
+    for path in paths:
+        with open(path, encoding="utf-8") as fh:
+            for line in fh:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+profile_cli = AppGroup("profile", help="Summarize request profiles and slow-request logs.")
+
+
+@profile_cli.command("report")
+@click.argument("paths", nargs=-1, type=click.Path(exists=True, dir_okay=False))
+@click.option("--top", default=10, show_default=True, help="Functions listed per route.")
+@click.option("--sort", "sort_key", type=click.Choice(["tottime", "cumtime"]), default="tottime", show_default=True)
+@click.option("--route", "only_route", help="Only report this route rule, e.g. /product/<pid>.")
+def profile_report(paths, top, sort_key, only_route):
+    """Aggregate profile logs into the hottest functions per route.
+
+    Reads PROFILE_LOG_PATH and its rotated backups unless files are given.
+    """
+    if not paths:
+        candidates = [PROFILE_LOG_PATH] + [
+            f"{PROFILE_LOG_PATH}.{n}" for n in range(1, PROFILE_LOG_BACKUPS + 1)
+        ]
+        paths = [p for p in candidates if os.path.exists(p)]
+    if not paths:
+        raise click.UsageError(f"No profile logs found at {PROFILE_LOG_PATH}.")
+
+    routes = {}
+    for record in read_profile_records(paths):
+        route = f"{record.get('method', '')} {record.get('route', '')}".strip()
+        if only_route and record.get("route") != only_route:
+            continue
+        entry = routes.setdefault(
+            route, {"durations": [], "queries": 0, "slow": 0, "profiled": 0, "functions": {}}
+        )
+        entry["durations"].append(record.get("duration_ms", 0.0))
+        entry["queries"] += record.get("queries", 0)
+        entry["slow"] += record.get("kind") == "slow"
+        if record.get("functions"):
+            entry["profiled"] += 1
+            for fn in record["functions"]:
+                agg = entry["functions"].setdefault(
+                    fn["function"], {"calls": 0, "tottime": 0.0, "cumtime": 0.0}
+                )
+                agg["calls"] += fn["calls"]
+                agg["tottime"] += fn["tottime"]
+                agg["cumtime"] += fn["cumtime"]
+
+    for route, entry in sorted(routes.items(), key=lambda kv: -sum(kv[1]["durations"])):
+        durations = sorted(entry["durations"])
+        count = len(durations)
+        click.echo(
+            f"{route}: {count} requests ({entry['slow']} slow, {entry['profiled']} profiled), "
+            f"p50 {percentile(durations, 0.5):.1f} ms, p95 {percentile(durations, 0.95):.1f} ms, "
+            f"{entry['queries'] / count:.1f} queries/request"
+        )
+        hottest = sorted(entry["functions"].items(), key=lambda kv: -kv[1][sort_key])[:top]
+        for name, agg in hottest:
+            click.echo(
+                f"    {agg['tottime']:9.4f}s own  {agg['cumtime']:9.4f}s cum  "
+                f"{agg['calls']:8d} calls  {name}"
+            )
+
+
+app.cli.add_command(profile_cli)
 
 
 @app.context_processor
 def inject_user_profile():
     """Expose basic user profile data to all templates for nav display."""
     uname = current_user()
-    profile = get_user(uname) if uname else None
+    profile = current_user_profile()
     display = None
     if profile:
         display = profile.get("display_name") or uname
@@ -353,7 +3099,7 @@ def current_user():
 
 
 def get_user(username):
-    conn = get_db()
+    conn = get_db("users")
     row = conn.execute(
         """
         SELECT username, email, display_name, card_brand, card_last4, card_exp, preferred_vehicle,
@@ -364,10 +3110,55 @@ def get_user(username):
         """,
         (username,),
     ).fetchone()
-    conn.close()
     return dict(row) if row else None
 
 
+# Optional cross-request cache of user profiles, per worker process. Other
+# workers may serve a profile up to USER_CACHE_TTL seconds stale after an
+# update, so it is off (0) unless configured.
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "0"))
+USER_CACHE_MAX = 10000
+_user_cache = {}  # {username: (expires_at, profile)}
+_user_cache_lock = threading.Lock()
+
+
+def get_user_cached(username):
+    """get_user() through the short-TTL cache when it is enabled."""
+    if USER_CACHE_TTL <= 0:
+        return get_user(username)
+    now = time.monotonic()
+    entry = _user_cache.get(username)
+    if entry and entry[0] > now:
+        return dict(entry[1])
+
+    profile = get_user(username)
+    if profile is not None:
+        with _user_cache_lock:
+            if len(_user_cache) >= USER_CACHE_MAX:
+                _user_cache.clear()
+            _user_cache[username] = (now + USER_CACHE_TTL, profile)
+        return dict(profile)
+    return None
+
+
+def current_user_profile():
+    """Profile of the logged-in user, loaded at most once per request."""
+    username = current_user()
+    if not username:
+        return None
+    if "user_profile" not in g:
+        g.user_profile = get_user_cached(username)
+    return g.user_profile
+
+
+def invalidate_user(username):
+    """Drop cached copies of a user's profile after it changes."""
+    with _user_cache_lock:
+        _user_cache.pop(username, None)
+    if has_request_context():
+        g.pop("user_profile", None)
+
+
 def update_user_profile(
     username,
     email,
@@ -378,38 +3169,39 @@ def update_user_profile(
     preferred_vehicle,
     ship_info=None,
 ):
-    conn = get_db()
-    cur = conn.cursor()
     ship_info = ship_info or {}
-    cur.execute(
-        """
-        UPDATE users
-        SET email = ?, display_name = ?, card_brand = ?, card_last4 = ?, card_exp = ?, preferred_vehicle = ?,
-            ship_name = ?, ship_line1 = ?, ship_line2 = ?, ship_city = ?, ship_state = ?, ship_zip = ?
-        WHERE username = ?
-        """,
-        (
-            email,
-            display_name,
-            card_brand,
-            card_last4,
-            card_exp,
-            preferred_vehicle,
-            ship_info.get("name"),
-            ship_info.get("line1"),
-            ship_info.get("line2"),
-            ship_info.get("city"),
-            ship_info.get("state"),
-            ship_info.get("zip"),
-            username,
-        ),
-    )
-    conn.commit()
-    conn.close()
+
+    def write(conn):
+        conn.execute(
+            """
+            UPDATE users
+            SET email = ?, display_name = ?, card_brand = ?, card_last4 = ?, card_exp = ?, preferred_vehicle = ?,
+                ship_name = ?, ship_line1 = ?, ship_line2 = ?, ship_city = ?, ship_state = ?, ship_zip = ?
+            WHERE username = ?
+            """,
+            (
+                email,
+                display_name,
+                card_brand,
+                card_last4,
+                card_exp,
+                preferred_vehicle,
+                ship_info.get("name"),
+                ship_info.get("line1"),
+                ship_info.get("line2"),
+                ship_info.get("city"),
+                ship_info.get("state"),
+                ship_info.get("zip"),
+                username,
+            ),
+        )
+
+    run_write("users", write)
+    invalidate_user(username)
 
 
 def find_user_by_email(email):
-    conn = get_db()
+    conn = get_db("users")
     row = conn.execute(
         """
         SELECT username, email, reset_token, reset_token_expires
@@ -417,7 +3209,6 @@ def find_user_by_email(email):
         """,
         (email,),
     ).fetchone()
-    conn.close()
     return dict(row) if row else None
 
 
@@ -427,20 +3218,21 @@ def set_reset_token(email):
         return None
     token = secrets.token_urlsafe(24)
     expires = (datetime.utcnow() + timedelta(hours=1)).isoformat()
-    conn = get_db()
-    conn.execute(
-        "UPDATE users SET reset_token = ?, reset_token_expires = ? WHERE email = ?",
-        (token, expires, email),
+    run_write(
+        "users",
+        lambda conn: conn.execute(
+            "UPDATE users SET reset_token = ?, reset_token_expires = ? WHERE email = ?",
+            (token, expires, email),
+        )
     )
-    conn.commit()
-    conn.close()
+    invalidate_user(user["username"])
     return token
 
 
 def validate_reset_token(token):
     if not token:
         return None
-    conn = get_db()
+    conn = get_db("users")
     row = conn.execute(
         """
         SELECT username, reset_token_expires
@@ -449,7 +3241,6 @@ def validate_reset_token(token):
         """,
         (token,),
     ).fetchone()
-    conn.close()
     if not row:
         return None
     expires = row["reset_token_expires"]
@@ -463,123 +3254,341 @@ def validate_reset_token(token):
 
 
 def clear_reset_token(username):
-    conn = get_db()
-    conn.execute(
-        "UPDATE users SET reset_token = NULL, reset_token_expires = NULL WHERE username = ?",
-        (username,),
+    run_write(
+        "users",
+        lambda conn: conn.execute(
+            "UPDATE users SET reset_token = NULL, reset_token_expires = NULL WHERE username = ?",
+            (username,),
+        )
     )
-    conn.commit()
-    conn.close()
+    invalidate_user(username)
+
+
+def reset_password(username, password_hash):
+    """Store a new password hash and spend the reset token in one write."""
+
+    def write(conn):
+        conn.execute(
+            """
+            UPDATE users
+            SET password_hash = ?, reset_token = NULL, reset_token_expires = NULL
+            WHERE username = ?
+            """,
+            (password_hash, username),
+        )
+
+    run_write("users", write)
+    invalidate_user(username)
 
 
-def user_cart(username):
-    """Return the cart list for a user (list of product IDs)."""
-    return cart_db.setdefault(username, [])
+# -------------------------------------------------
+# Cart store (one row per user and product)
+# -------------------------------------------------
+def get_cart(username):
+    """Return the user's cart as {product_id: qty}, oldest line first."""
+    rows = get_db("orders").execute(
+        """
+        SELECT product_id, qty FROM cart_items
+        WHERE username = ?
+        ORDER BY added_at, rowid
+        """,
+        (username,),
+    ).fetchall()
+    return {row["product_id"]: row["qty"] for row in rows}
 
 
-def add_item_to_cart(username: str, pid: str):
-    """Add one product ID to the user's cart if the product exists."""
+def add_item_to_cart(username: str, pid: str, qty: int = 1):
+    """Add ``qty`` of a product to the user's cart if the product exists."""
     if not get_product_by_id(pid):
         return False
-    user_cart(username).append(pid)
+    run_write(
+        "orders",
+        lambda conn: conn.execute(
+            """
+            INSERT INTO cart_items (username, product_id, qty)
+            VALUES (?, ?, ?)
+            ON CONFLICT (username, product_id) DO UPDATE SET qty = qty + excluded.qty
+            """,
+            (username, pid, qty),
+        )
+    )
     return True
 
 
+def decrement_cart_item(username: str, pid: str):
+    """Take one unit of a product out of the cart, dropping the line at zero."""
+
+    def write(conn):
+        cur = conn.execute(
+            "UPDATE cart_items SET qty = qty - 1 WHERE username = ? AND product_id = ? AND qty > 1",
+            (username, pid),
+        )
+        if cur.rowcount == 0:
+            cur = conn.execute(
+                "DELETE FROM cart_items WHERE username = ? AND product_id = ?",
+                (username, pid),
+            )
+        return cur.rowcount > 0
+
+    return run_write("orders", write)
+
+
 def remove_item_from_cart(username: str, pid: str):
-    """Remove all instances of a product ID from the user's cart."""
-    cart = user_cart(username)
-    if not cart:
-        return False
-    new_cart = [item for item in cart if item != pid]
-    cart_db[username] = new_cart
-    return len(new_cart) != len(cart)
+    """Remove a product line (all units) from the user's cart."""
+    cur = run_write(
+        "orders",
+        lambda conn: conn.execute(
+            "DELETE FROM cart_items WHERE username = ? AND product_id = ?",
+            (username, pid),
+        )
+    )
+    return cur.rowcount > 0
 
 
-def build_order_lines(item_ids):
-    """Return (items, total) for given product IDs."""
-    counts = Counter(item_ids)
-    order_items = []
-    total = 0.0
+def clear_cart(username: str):
+    run_write("orders", lambda conn: conn.execute("DELETE FROM cart_items WHERE username = ?", (username,)))
 
-    for pid, qty in counts.items():
-        part = get_product_by_id(pid)
-        if not part:
-            continue
 
-        line_total = part["price"] * qty
-        total += line_total
-        order_items.append(
+# -------------------------------------------------
+# Cart pricing (integer cents)
+# -------------------------------------------------
+def to_cents(amount):
+    return int(round(amount * 100))
+
+
+def get_products_by_ids(pids):
+    """Resolve many product ids at once; unknown ids are left out."""
+    catalog = catalog_cache.snapshot()
+    found = {pid: catalog.get(pid) for pid in pids}
+    return {pid: part for pid, part in found.items() if part is not None}
+
+
+class PricedCart:
+    """A cart resolved against the catalog once, with money held in cents.
+
+    Lines carry both integer cents (for totals and Stripe) and rounded
+    dollar floats (for templates and the orders tables).
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.total_cents = sum(line["line_cents"] for line in lines)
+
+    def __bool__(self):
+        return bool(self.lines)
+
+    @property
+    def total(self):
+        return self.total_cents / 100
+
+    @property
+    def item_count(self):
+        return sum(line["qty"] for line in self.lines)
+
+    def quantities(self):
+        return {line["id"]: line["qty"] for line in self.lines}
+
+    def item_ids(self):
+        """Flat product-id list, one entry per unit."""
+        return [line["id"] for line in self.lines for _ in range(line["qty"])]
+
+    def stripe_line_items(self):
+        return [
             {
-                "id": pid,
-                "name": part["name"],
-                "qty": qty,
-                "unit_price": round(part["price"], 2),
-                "line_total": round(line_total, 2),
+                "price_data": {
+                    "currency": "usd",
+                    "product_data": {"name": line["name"]},
+                    "unit_amount": line["unit_cents"],
+                },
+                "quantity": line["qty"],
             }
+            for line in self.lines
+        ]
+
+
+def valid_quantity(qty):
+    """True for a positive whole quantity (JSON true/false do not count)."""
+    return isinstance(qty, int) and not isinstance(qty, bool) and qty > 0
+
+
+def valid_cart_items(items):
+    """True for a list of product ids or a {product_id: qty} dict, as sent by clients."""
+    if isinstance(items, dict):
+        return all(isinstance(pid, str) and valid_quantity(qty) for pid, qty in items.items())
+    return isinstance(items, list) and all(isinstance(pid, str) for pid in items)
+
+
+def price_cart(quantities):
+    """Price a cart given {product_id: qty} or a flat list of product ids.
+
+    Unknown products and lines without a valid quantity are left out.
+    """
+    if not isinstance(quantities, dict):
+        quantities = Counter(quantities)
+    parts = get_products_by_ids(quantities)
+
+    lines = []
+    for pid, qty in quantities.items():
+        part = parts.get(pid)
+        if not part or not valid_quantity(qty):
+            continue
+        lines.append(
+            priced_line(pid, part["name"], part.get("fitment"), qty, to_cents(part["price"]))
+        )
+    return PricedCart(lines)
+
+
+def priced_line(pid, name, fitment, qty, unit_cents):
+    line_cents = unit_cents * qty
+    return {
+        "id": pid,
+        "name": name,
+        "fitment": fitment or "",
+        "qty": qty,
+        "unit_cents": unit_cents,
+        "line_cents": line_cents,
+        "unit_price": unit_cents / 100,
+        "line_total": line_cents / 100,
+    }
+
+
+# -------------------------------------------------
+# Checkout snapshots (prices frozen when the shopper pays)
+# -------------------------------------------------
+# Stripe metadata and the session cookie carry only the snapshot id, so
+# cart size is unbounded and the order is billed at the prices shown.
+CHECKOUT_SNAPSHOT_TTL_HOURS = 48
+
+
+def create_checkout_snapshot(username, priced):
+    """Freeze a priced cart and return its short id."""
+    snapshot_id = secrets.token_urlsafe(9)
+
+    def write(conn):
+        # abandoned checkouts: Stripe sessions expire long before this
+        conn.execute(
+            "DELETE FROM checkout_snapshots WHERE created_at < datetime('now', ?)",
+            (f"-{CHECKOUT_SNAPSHOT_TTL_HOURS} hours",),
+        )
+        conn.execute(
+            "INSERT INTO checkout_snapshots (id, username, total_cents) VALUES (?, ?, ?)",
+            (snapshot_id, username, priced.total_cents),
+        )
+        conn.executemany(
+            """
+            INSERT INTO checkout_snapshot_lines
+                (snapshot_id, position, product_id, name, fitment, qty, unit_cents)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (snapshot_id, n, line["id"], line["name"], line["fitment"], line["qty"], line["unit_cents"])
+                for n, line in enumerate(priced.lines)
+            ],
         )
 
-    if not order_items:
-        return [], 0.0
+    run_write("orders", write)
+    return snapshot_id
+
+
+def load_checkout_snapshot(snapshot_id):
+    """Return (username, PricedCart) for a snapshot, or (None, None) if unknown."""
+    conn = get_db("orders")
+    head = conn.execute(
+        "SELECT username FROM checkout_snapshots WHERE id = ?", (snapshot_id,)
+    ).fetchone()
+    if head is None:
+        return None, None
+    rows = conn.execute(
+        """
+        SELECT product_id, name, fitment, qty, unit_cents
+        FROM checkout_snapshot_lines
+        WHERE snapshot_id = ?
+        ORDER BY position
+        """,
+        (snapshot_id,),
+    ).fetchall()
+    lines = [
+        priced_line(r["product_id"], r["name"], r["fitment"], r["qty"], r["unit_cents"])
+        for r in rows
+    ]
+    return head["username"], PricedCart(lines)
 
-    return order_items, round(total, 2)
 
+def create_order(
+    username: str, priced, shipping=None, card_info=None, stripe_pid=None, stripe_session_id=None
+):
+    """Persist a priced cart as an order and return the created order dict.
 
-def create_order(username: str, item_ids, shipping=None, card_info=None, stripe_pid=None):
-    """Persist an order to the database and return the created order dict."""
-    order_items, total = build_order_lines(item_ids)
-    if not order_items:
+    Raises sqlite3.IntegrityError if an order already exists for the
+    Stripe payment or checkout session.
+    """
+    if not priced:
         return None
 
+    total = priced.total
+    order_items = [
+        {
+            "id": line["id"],
+            "name": line["name"],
+            "qty": line["qty"],
+            "unit_price": line["unit_price"],
+            "line_total": line["line_total"],
+        }
+        for line in priced.lines
+    ]
+
     shipping = shipping or {}
     card_info = card_info or {}
     created_at = datetime.now().strftime("%Y-%m-%d %H:%M")
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO orders (
-            username, created_at, total,
-            card_brand, card_last4, stripe_pid,
-            shipping_name, shipping_line1, shipping_line2,
-            shipping_city, shipping_state, shipping_zip
-        )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-            username,
-            created_at,
-            total,
-            card_info.get("brand"),
-            card_info.get("last4"),
-            stripe_pid,
-            shipping.get("name"),
-            shipping.get("line1"),
-            shipping.get("line2"),
-            shipping.get("city"),
-            shipping.get("state"),
-            shipping.get("zip"),
-        ),
-    )
-    order_id = cur.lastrowid
 
-    for item in order_items:
-        cur.execute(
+    def write(conn):
+        cur = conn.execute(
             """
-            INSERT INTO order_items (order_id, product_id, name, qty, unit_price, line_total)
-            VALUES (?, ?, ?, ?, ?, ?)
+            INSERT INTO orders (
+                username, created_at, total,
+                card_brand, card_last4, stripe_pid, stripe_session_id,
+                shipping_name, shipping_line1, shipping_line2,
+                shipping_city, shipping_state, shipping_zip
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """,
             (
-                order_id,
-                item["id"],
-                item["name"],
-                item["qty"],
-                item["unit_price"],
-                item["line_total"],
+                username,
+                created_at,
+                total,
+                card_info.get("brand"),
+                card_info.get("last4"),
+                stripe_pid,
+                stripe_session_id,
+                shipping.get("name"),
+                shipping.get("line1"),
+                shipping.get("line2"),
+                shipping.get("city"),
+                shipping.get("state"),
+                shipping.get("zip"),
             ),
         )
+        order_id = cur.lastrowid
+        conn.executemany(
+            """
+            INSERT INTO order_items (order_id, product_id, name, qty, unit_price, line_total)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (
+                    order_id,
+                    item["id"],
+                    item["name"],
+                    item["qty"],
+                    item["unit_price"],
+                    item["line_total"],
+                )
+                for item in order_items
+            ],
+        )
+        return order_id
 
-    conn.commit()
-    conn.close()
+    order_id = run_write("orders", write)
 
     return {
         "order_id": order_id,
@@ -608,111 +3617,210 @@ def create_stripe_payment_intent(amount_cents, shipping, username):
     if not stripe_enabled():
         return (None, None)
     try:
-        intent = stripe.PaymentIntent.create(
-            amount=int(amount_cents),
-            currency="usd",
-            description=f"Order for {username}",
-            payment_method="pm_card_visa",  # Stripe test payment method
-            confirm=True,
-            shipping={
-                "name": shipping.get("name") or username,
-                "address": {
-                    "line1": shipping.get("line1") or "123 Test St",
-                    "line2": shipping.get("line2") or "",
-                    "city": shipping.get("city") or "Test City",
-                    "state": shipping.get("state") or "CA",
-                    "postal_code": shipping.get("zip") or "00000",
-                    "country": "US",
+        with stripe_timer("payment_intent.create"):
+            intent = stripe.PaymentIntent.create(
+                amount=int(amount_cents),
+                currency="usd",
+                description=f"Order for {username}",
+                payment_method="pm_card_visa",  # Stripe test payment method
+                confirm=True,
+                shipping={
+                    "name": shipping.get("name") or username,
+                    "address": {
+                        "line1": shipping.get("line1") or "123 Test St",
+                        "line2": shipping.get("line2") or "",
+                        "city": shipping.get("city") or "Test City",
+                        "state": shipping.get("state") or "CA",
+                        "postal_code": shipping.get("zip") or "00000",
+                        "country": "US",
+                    },
                 },
-            },
-        )
+            )
         return (intent["id"], None)
     except Exception as e:
         return (None, str(e))
 
 
-def create_stripe_checkout_session(username, item_ids, shipping):
+def create_stripe_checkout_session(username, priced, shipping, snapshot_id):
     """Create a Stripe Checkout Session to show hosted payment page."""
     if not stripe_enabled():
         return (None, "Stripe not configured")
 
-    order_items, total = build_order_lines(item_ids)
-    if not order_items:
+    if not priced:
         return (None, "Cart is empty")
 
-    line_items = []
-    for item in order_items:
-        line_items.append(
-            {
-                "price_data": {
-                    "currency": "usd",
-                    "product_data": {"name": item["name"]},
-                    "unit_amount": int(item["unit_price"] * 100),
+    try:
+        with stripe_timer("checkout.session.create"):
+            session_obj = stripe.checkout.Session.create(
+                mode="payment",
+                payment_method_types=["card"],
+                line_items=priced.stripe_line_items(),
+                success_url=url_for("payment_success", _external=True, _scheme="http") + "?session_id={CHECKOUT_SESSION_ID}",
+                cancel_url=url_for("payment", _external=True, _scheme="http"),
+                shipping_address_collection={"allowed_countries": ["US"]},
+                client_reference_id=snapshot_id,
+                metadata={
+                    "username": username,
+                    "checkout_id": snapshot_id,
                 },
-                "quantity": item["qty"],
-            }
-        )
+            )
+        return (session_obj.url, None)
+    except Exception as e:
+        return (None, str(e))
+
+
+# -------------------------------------------------
+# Checkout finalization (Stripe webhook)
+# -------------------------------------------------
+CHECKOUT_PAID_EVENTS = ("checkout.session.completed", "checkout.session.async_payment_succeeded")
+# The pending success page reloads after 2s, doubling up to 30s, and stops
+# after this many reloads (about a minute and a half) so an open tab does
+# not poll forever; the order still lands via the webhook.
+PAYMENT_PENDING_REFRESHES = 6
+PAYMENT_PENDING_MAX_DELAY = 30
+
+
+def find_order_by_checkout_session(session_id):
+    row = get_db("orders").execute(
+        "SELECT id, username FROM orders WHERE stripe_session_id = ?", (session_id,)
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def finalize_checkout(checkout_session):
+    """Create the order for a paid Checkout Session once; return its order id.
+
+    Safe to repeat and to race (webhook retries, success-page reloads): the
+    unique index on stripe_session_id turns a second insert into a lookup.
+    """
+    session_id = checkout_session.get("id")
+    existing = find_order_by_checkout_session(session_id)
+    if existing:
+        return existing["id"]
+
+    metadata = checkout_session.get("metadata") or {}
+    snapshot_id = metadata.get("checkout_id") or checkout_session.get("client_reference_id")
+    if snapshot_id:
+        username, priced = load_checkout_snapshot(snapshot_id)
+    else:
+        # sessions opened before snapshots listed their product ids instead
+        username = metadata.get("username")
+        priced = price_cart([pid for pid in (metadata.get("cart_items") or "").split(",") if pid])
+    if not username or not priced:
+        return None
+
+    payment_intent_id = checkout_session.get("payment_intent")
+    brand = None
+    last4 = None
+    if payment_intent_id:
+        with stripe_timer("payment_intent.retrieve"):
+            pi = stripe.PaymentIntent.retrieve(payment_intent_id)
+        if pi.charges and pi.charges.data:
+            charge = pi.charges.data[0]
+            pm_details = charge.get("payment_method_details", {}).get("card", {})
+            brand = pm_details.get("brand")
+            last4 = pm_details.get("last4")
+    shipping_details = checkout_session.get("shipping") or {}
+    ship_addr = shipping_details.get("address") or {}
 
     try:
-        session_obj = stripe.checkout.Session.create(
-            mode="payment",
-            payment_method_types=["card"],
-            line_items=line_items,
-            success_url=url_for("payment_success", _external=True, _scheme="http") + "?session_id={CHECKOUT_SESSION_ID}",
-            cancel_url=url_for("payment", _external=True, _scheme="http"),
-            shipping_address_collection={"allowed_countries": ["US"]},
-            metadata={
-                "username": username,
-                "cart_items": ",".join(item_ids),
+        order = create_order(
+            username,
+            priced,
+            shipping={
+                "name": shipping_details.get("name"),
+                "line1": ship_addr.get("line1"),
+                "line2": ship_addr.get("line2"),
+                "city": ship_addr.get("city"),
+                "state": ship_addr.get("state"),
+                "zip": ship_addr.get("postal_code"),
+            },
+            card_info={
+                "brand": brand,
+                "last4": last4,
             },
+            stripe_pid=payment_intent_id,
+            stripe_session_id=session_id,
         )
-        return (session_obj.url, None)
-    except Exception as e:
-        return (None, str(e))
+    except sqlite3.IntegrityError:
+        existing = find_order_by_checkout_session(session_id)
+        return existing["id"] if existing else None
+    if not order:
+        return None
+    clear_cart(username)
+    return order["order_id"]
 
 
-def fetch_orders(username: str):
-    """Return all orders (with items) for a user, newest first."""
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute(
-        """
+def sign_webhook_payload(payload, secret, timestamp=None):
+    """Return a Stripe-Signature header for ``payload``, for locally faked events."""
+    timestamp = int(time.time()) if timestamp is None else int(timestamp)
+    digest = hmac.new(
+        secret.encode("utf-8"), f"{timestamp}.{payload}".encode("utf-8"), hashlib.sha256
+    ).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+
+ORDERS_PAGE_SIZE = int(os.getenv("ORDERS_PAGE_SIZE", "20"))
+ORDERS_PAGE_SIZE_MAX = 100
+
+
+def fetch_orders(username: str, before=None, limit=ORDERS_PAGE_SIZE):
+    """Return (orders, next_cursor) for one page of a user's history, newest first.
+
+    Pages are keyed on orders.id; the items for the whole page are loaded
+    with one batched IN query instead of one query per order.
+    """
+    conn = get_db("orders")
+    params = [username]
+    before_sql = ""
+    if before is not None:
+        before_sql = "AND id < ?"
+        params.append(before)
+    orders = conn.execute(
+        f"""
         SELECT id, created_at, total, card_brand, card_last4, stripe_pid,
                shipping_name, shipping_line1, shipping_line2,
                shipping_city, shipping_state, shipping_zip
         FROM orders
-        WHERE username = ?
+        WHERE username = ? {before_sql}
         ORDER BY id DESC
+        LIMIT ?
         """,
-        (username,),
-    )
-    orders = cur.fetchall()
+        (*params, limit + 1),
+    ).fetchall()
+    next_cursor = encode_cursor([orders[limit - 1]["id"]]) if len(orders) > limit else None
+    orders = orders[:limit]
+
+    items_by_order = {order["id"]: [] for order in orders}
+    if items_by_order:
+        placeholders = ",".join("?" * len(items_by_order))
+        rows = conn.execute(
+            f"""
+            SELECT order_id, product_id, name, qty, unit_price, line_total
+            FROM order_items
+            WHERE order_id IN ({placeholders})
+            ORDER BY id
+            """,
+            list(items_by_order),
+        ).fetchall()
+        for row in rows:
+            items_by_order[row["order_id"]].append(
+                {
+                    "id": row["product_id"],
+                    "name": row["name"],
+                    "qty": row["qty"],
+                    "unit_price": row["unit_price"],
+                    "line_total": row["line_total"],
+                }
+            )
 
     results = []
     for order in orders:
-        cur.execute(
-            """
-            SELECT product_id, name, qty, unit_price, line_total
-            FROM order_items
-            WHERE order_id = ?
-            """,
-            (order["id"],),
-        )
-        items = [
-            {
-                "id": row["product_id"],
-                "name": row["name"],
-                "qty": row["qty"],
-                "unit_price": row["unit_price"],
-                "line_total": row["line_total"],
-            }
-            for row in cur.fetchall()
-        ]
         results.append(
             {
                 "order_id": order["id"],
                 "created_at": order["created_at"],
-                "items": items,
+                "items": items_by_order[order["id"]],
                 "total": order["total"],
                 "card_brand": order["card_brand"],
                 "card_last4": order["card_last4"],
@@ -728,25 +3836,180 @@ def fetch_orders(username: str):
             }
         )
 
-    conn.close()
-    return results
+    return results, next_cursor
+
+
+# -------------------------------------------------
+# Password hashing pool and auth throttling
+# -------------------------------------------------
+# Hashes are deliberately slow CPU work; running them in worker processes
+# keeps them from holding the GIL over every other request. HASH_WORKERS=0
+# hashes inline on the request thread instead.
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "2"))
+HASH_QUEUE_DEPTH = int(os.getenv("HASH_QUEUE_DEPTH", "16"))
+HASH_TIMEOUT = float(os.getenv("HASH_TIMEOUT", "10"))
+
+# Per worker process: attempts allowed per minute, refilled continuously.
+# The per-IP limit is off by default: behind a proxy every client shares the
+# proxy's address unless TRUSTED_PROXIES is set, and one bucket for everyone
+# would lock all users out together.
+AUTH_ATTEMPTS_PER_USER = int(os.getenv("AUTH_ATTEMPTS_PER_USER", "5"))
+AUTH_ATTEMPTS_PER_IP = int(os.getenv("AUTH_ATTEMPTS_PER_IP", "0"))
+
+metrics.describe("password_hash_rejected_total", "counter", "Hash jobs refused: pool saturated.")
+metrics.describe("password_hash_pool_broken_total", "counter", "Hash jobs retried after a pool worker died.")
+metrics.describe("auth_throttled_total", "counter", "Auth attempts refused by rate limiting.")
+
+
+class HashingBusy(Exception):
+    """The hashing pool already has HASH_QUEUE_DEPTH jobs in flight."""
+
+
+class PasswordHasher:
+    """Run werkzeug hash/check calls in a bounded process pool.
+
+    At most ``max_pending`` jobs may be queued or running; beyond that
+    callers get HashingBusy immediately instead of waiting in line. A pool
+    whose worker died is replaced and the job retried once.
+    """
+
+    def __init__(self, workers=HASH_WORKERS, max_pending=HASH_QUEUE_DEPTH, timeout=HASH_TIMEOUT):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def _executor(self, broken=None):
+        with self._lock:
+            if self._pool is not None and self._pool is broken:
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+            if self._pool is None or self._pid != os.getpid():
+                # spawn: never fork a process that is running server threads
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+                self._pid = os.getpid()
+                self._slots = threading.BoundedSemaphore(self.max_pending)
+            return self._pool
+
+    def run(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+        broken = None
+        for _ in range(2):
+            pool = self._executor(broken)
+            slots = self._slots
+            if not slots.acquire(blocking=False):
+                metrics.inc("password_hash_rejected_total")
+                raise HashingBusy()
+            try:
+                future = pool.submit(fn, *args)
+            except BrokenProcessPool:
+                slots.release()
+                broken = pool
+                continue
+            except Exception:
+                slots.release()
+                raise
+            # the slot is held until the job really finishes, even if we time out
+            future.add_done_callback(lambda _, slots=slots: slots.release())
+            try:
+                return future.result(timeout=self.timeout)
+            except FuturesTimeout:
+                raise HashingBusy()
+            except BrokenProcessPool:
+                # a worker died (OOM killer, signal); rebuild the pool and retry
+                metrics.inc("password_hash_pool_broken_total")
+                broken = pool
+        raise HashingBusy()
+
+    def generate(self, password):
+        return self.run(generate_password_hash, password)
+
+    def check(self, pwhash, password):
+        return self.run(check_password_hash, pwhash, password)
+
+
+password_hasher = PasswordHasher()
+
+
+class TokenBucketLimiter:
+    """Per-key token buckets holding up to ``capacity`` tokens.
+
+    Buckets refill at ``capacity / per_seconds`` tokens a second; the least
+    recently used keys are dropped beyond ``max_keys``.
+    """
+
+    def __init__(self, capacity, per_seconds=60.0, max_keys=100_000):
+        self.capacity = capacity
+        self.rate = capacity / per_seconds
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def allow(self, key):
+        if self.capacity <= 0:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return allowed
+
+
+user_throttle = TokenBucketLimiter(AUTH_ATTEMPTS_PER_USER)
+ip_throttle = TokenBucketLimiter(AUTH_ATTEMPTS_PER_IP)
+
+
+def auth_attempt_allowed(action, account=None):
+    """Spend one token from the client IP's bucket and the account's, if given.
+
+    The IP is ``request.remote_addr``, which ProxyFix rewrites to the
+    forwarded client address when TRUSTED_PROXIES is set.
+    """
+    allowed = ip_throttle.allow((action, request.remote_addr))
+    if allowed and account:
+        allowed = user_throttle.allow((action, account.lower()))
+    if not allowed:
+        metrics.inc("auth_throttled_total", action=action)
+    return allowed
+
+
+def throttled_response(template, status=429, retry_after=60, **context):
+    """Render an auth page with a 'try again later' message and Retry-After."""
+    if status == 429:
+        msg = "Too many attempts. Please wait a minute and try again."
+    else:
+        msg = "We're handling a lot of sign-ins right now. Please try again."
+    response = app.make_response((render_template(template, msg=msg, ok=False, **context), status))
+    response.headers["Retry-After"] = str(retry_after)
+    return response
 
 
 def register_user(username, email, password):
     """Insert a new user with a hashed password into the users table."""
-    password_hash = generate_password_hash(password)
+    password_hash = password_hasher.generate(password)
     try:
-        conn = get_db()
-        cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT INTO users (username, email, password_hash, display_name, card_exp, preferred_vehicle)
-            VALUES (?, ?, ?, ?, ?, ?)
-            """,
-            (username, email, password_hash, username, None, None),
+        run_write(
+            "users",
+            lambda conn: conn.execute(
+                """
+                INSERT INTO users (username, email, password_hash, display_name, card_exp, preferred_vehicle)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (username, email, password_hash, username, None, None),
+            )
         )
-        conn.commit()
-        conn.close()
         return (True, "Account created successfully.")
     except sqlite3.IntegrityError:
         # Username must be unique
@@ -755,19 +4018,18 @@ def register_user(username, email, password):
 
 def authenticate(username, password):
     """Check username + password against stored hash."""
-    conn = get_db()
+    conn = get_db("users")
     cur = conn.cursor()
     cur.execute(
         "SELECT username, password_hash FROM users WHERE username = ?",
         (username,),
     )
     row = cur.fetchone()
-    conn.close()
 
     if row is None:
         return False
 
-    return check_password_hash(row["password_hash"], password)
+    return password_hasher.check(row["password_hash"], password)
 
 
 # -------------------------------------------------
@@ -777,40 +4039,100 @@ def authenticate(username, password):
 def shop():
     """Main shop page, rendered on the server (no JS DOM building)."""
     banner = session.pop("flash_msg", None)
-    query = request.args.get("q", "").strip()
+    query = " ".join(request.args.get("q", "").split())
     vehicle = request.args.get("vehicle", "").strip()
 
     # default to preferred vehicle if none selected
     if logged_in() and not vehicle:
-        profile = get_user(current_user())
+        profile = current_user_profile()
         if profile and profile.get("preferred_vehicle"):
             vehicle = profile["preferred_vehicle"]
 
-    # Filter products server-side so the template can render directly
-    parts = []
-    for p in get_all_products():
-        name = (p.get("name") or "").lower()
-        category = (p.get("category") or "").lower()
-        fitment = (p.get("fitment") or "").lower()
-        q = query.lower()
-        v = vehicle.lower()
-
-        matches_text = not q or q in name or q in category or q in fitment
-        matches_vehicle = not v or v in fitment
-
-        if matches_text and matches_vehicle:
-            parts.append(p)
+    category = request.args.get("category", "").strip()
+    min_price, max_price = price_arg("min_price"), price_arg("max_price")
+    sort = request.args.get("sort", "name")
+    if sort not in ColumnarCatalog.SORTS:
+        sort = "name"
+    limit = int_arg("limit", PAGE_SIZE, minimum=1, maximum=PAGE_SIZE_MAX)
+    offset = int_arg("offset", 0) if query else 0
+    cursor = None if query else request.args.get("cursor")
+
+    # Anonymous pages without a banner depend only on these arguments and
+    # the catalog, so the rendered HTML can be reused
+    cache_key = None
+    if not banner and not logged_in():
+        catalog_cache.snapshot()
+        cache_key = (
+            catalog_cache.version, query, vehicle, category, min_price, max_price, sort,
+            limit, offset, cursor,
+        )
+        html = shop_page_cache.get(cache_key)
+        if html is not None:
+            return html
+
+    # Filter products server-side so the template can render directly, one
+    # page at a time: ranked search pages by offset, browsing the columnar
+    # catalog by keyset cursor
+    page_args = {
+        "q": query or None,
+        "vehicle": vehicle or None,
+        "category": category or None,
+        "min_price": request.args.get("min_price") if min_price is not None else None,
+        "max_price": request.args.get("max_price") if max_price is not None else None,
+        "sort": sort if sort != "name" else None,
+    }
+    if limit != PAGE_SIZE:
+        page_args["limit"] = limit
+    next_url = None
+    corrected = None
+    if query:
+        parts, total = search_products(
+            query, vehicle, limit=limit, offset=offset,
+            category=category, min_price=min_price, max_price=max_price, sort=sort,
+        )
+        if not total:
+            ready = fuzzy_index.ready
+            parts, total, corrected = fuzzy_search_products(
+                query, vehicle, limit=limit, offset=offset,
+                category=category, min_price=min_price, max_price=max_price, sort=sort,
+            )
+            # answered from a missing or outgoing index: don't keep the page
+            # for the rest of this catalog version
+            if not (ready and fuzzy_index.ready):
+                cache_key = None
+        paged = offset > 0
+        if offset + len(parts) < total:
+            next_url = url_for("shop", offset=offset + limit, **page_args)
+    else:
+        parts, total, next_cursor = browse_catalog(
+            vehicle, category, min_price, max_price, sort, decode_product_cursor(cursor, sort), limit
+        )
+        paged = bool(cursor)
+        if next_cursor:
+            next_url = url_for("shop", cursor=next_cursor, **page_args)
 
-    return render_template(
+    html = render_template(
         "shop.html",
         parts=parts,
+        total=total,
+        next_url=next_url,
+        first_url=url_for("shop", **page_args) if paged else None,
         logged_in=logged_in(),
         username=current_user(),
         query=query,
+        corrected=corrected,
         vehicle=vehicle,
-        vehicle_options=VEHICLE_OPTIONS,
+        vehicle_options=get_vehicle_options(),
+        category=category,
+        category_options=catalog_cache.snapshot().category_options(),
+        min_price=page_args["min_price"] or "",
+        max_price=page_args["max_price"] or "",
+        sort=sort,
         banner=banner,
     )
+    if cache_key is not None:
+        shop_page_cache.put(cache_key, html)
+    return html
 
 
 @app.route("/product/<pid>")
@@ -837,8 +4159,13 @@ def register():
         password = request.form.get("password", "")
         if not username or not email or not password:
             msg = "All fields are required."
+        elif not auth_attempt_allowed("register"):
+            return throttled_response("register.html")
         else:
-            ok, msg = register_user(username, email, password)
+            try:
+                ok, msg = register_user(username, email, password)
+            except HashingBusy:
+                return throttled_response("register.html", status=503, retry_after=1)
     return render_template("register.html", msg=msg, ok=ok)
 
 
@@ -848,7 +4175,13 @@ def login():
     if request.method == "POST":
         username = request.form.get("username", "").strip()
         password = request.form.get("password", "")
-        if authenticate(username, password):
+        if not auth_attempt_allowed("login", username):
+            return throttled_response("login.html")
+        try:
+            authenticated = authenticate(username, password)
+        except HashingBusy:
+            return throttled_response("login.html", status=503, retry_after=1)
+        if authenticated:
             session["username"] = username
             msg = "Login Successful"
             ok = True
@@ -870,6 +4203,8 @@ def reset_request():
         email = request.form.get("email", "").strip()
         if not email:
             msg = "Enter the email on your account."
+        elif not auth_attempt_allowed("reset", email):
+            return throttled_response("reset_request.html", token=None)
         else:
             token = set_reset_token(email)
             if token:
@@ -890,16 +4225,15 @@ def reset_form(token):
         new_pw = request.form.get("password", "")
         if len(new_pw) < 6:
             msg = "Password must be at least 6 characters."
+        elif not auth_attempt_allowed("reset", username):
+            return throttled_response("reset_form.html", invalid=False, token=token)
         else:
-            pw_hash = generate_password_hash(new_pw)
-            conn = get_db()
-            conn.execute(
-                "UPDATE users SET password_hash = ? WHERE username = ?",
-                (pw_hash, username),
-            )
-            conn.commit()
-            conn.close()
-            clear_reset_token(username)
+            try:
+                reset_password(username, password_hasher.generate(new_pw))
+            except HashingBusy:
+                return throttled_response(
+                    "reset_form.html", status=503, retry_after=1, invalid=False, token=token
+                )
             msg = "Password updated. You can now log in."
             ok = True
     return render_template("reset_form.html", invalid=False, token=token, msg=msg, ok=ok)
@@ -911,11 +4245,12 @@ def profile():
     if not username:
         return redirect(url_for("login"))
 
-    user = get_user(username)
+    user = current_user_profile()
     if not user:
         session.pop("username", None)
         session["flash_msg"] = "Please log in again."
         return redirect(url_for("login"))
+    user = dict(user)  # edited below; keep the request-cached copy intact
 
     msg, ok = None, False
 
@@ -968,7 +4303,7 @@ def profile():
                     "zip": ship_zip or None,
                 },
             )
-            user = get_user(username)
+            user = dict(current_user_profile() or {})
             msg = "Profile updated."
             ok = True
         # reflect entered values even if validation fails
@@ -997,7 +4332,7 @@ def profile():
         user=user,
         msg=msg,
         ok=ok,
-        vehicle_options=VEHICLE_OPTIONS,
+        vehicle_options=get_vehicle_options(),
     )
 
 
@@ -1007,36 +4342,16 @@ def cart():
     if not username:
         return redirect(url_for("login"))
 
-    items = []
-    total = 0.0
-    counts = Counter(user_cart(username))
-
-    for pid, qty in counts.items():
-        part = get_product_by_id(pid)
-        if not part:
-            continue
-        line_total = round(part["price"] * qty, 2)
-        total += line_total
-        items.append(
-            {
-                "id": pid,
-                "name": part["name"],
-                "fitment": part.get("fitment", ""),
-                "qty": qty,
-                "unit_price": round(part["price"], 2),
-                "line_total": line_total,
-            }
-        )
-
+    priced = price_cart(get_cart(username))
     banner = session.pop("cart_flash", None)
 
     return render_template(
         "cart.html",
         logged_in=True,
         username=username,
-        items=items,
-        total=round(total, 2),
-        item_count=sum(counts.values()),
+        items=priced.lines,
+        total=priced.total,
+        item_count=priced.item_count,
         banner=banner,
     )
 
@@ -1047,13 +4362,19 @@ def orders():
     if not username:
         return redirect(url_for("login"))
 
-    user_orders = fetch_orders(username)
+    # a malformed cursor just shows the first page
+    before = decode_order_cursor(request.args.get("cursor"))
+    limit = int_arg("limit", ORDERS_PAGE_SIZE, minimum=1, maximum=ORDERS_PAGE_SIZE_MAX)
+    user_orders, next_cursor = fetch_orders(username, before=before, limit=limit)
+    page_args = {"limit": limit} if limit != ORDERS_PAGE_SIZE else {}
     banner = session.pop("order_flash", None)
     return render_template(
         "orders.html",
         logged_in=True,
         username=username,
         orders=user_orders,
+        next_url=url_for("orders", cursor=next_cursor, **page_args) if next_cursor else None,
+        first_url=url_for("orders", **page_args) if before is not None else None,
         banner=banner,
     )
 
@@ -1064,38 +4385,19 @@ def payment():
     if not username:
         return redirect(url_for("login"))
 
-    counts = Counter(user_cart(username))
-    items = []
-    total = 0.0
-    for pid, qty in counts.items():
-        part = get_product_by_id(pid)
-        if not part:
-            continue
-        line_total = round(part["price"] * qty, 2)
-        total += line_total
-        items.append(
-            {
-                "id": pid,
-                "name": part["name"],
-                "fitment": part.get("fitment", ""),
-                "qty": qty,
-                "unit_price": round(part["price"], 2),
-                "line_total": line_total,
-            }
-        )
-
-    if not items:
+    priced = price_cart(get_cart(username))
+    if not priced:
         session["cart_flash"] = "Your cart is empty. Add items before paying."
         return redirect(url_for("cart"))
 
-    user = get_user(username)
+    user = current_user_profile()
 
     return render_template(
         "payment.html",
         logged_in=True,
         username=username,
-        items=items,
-        total=round(total, 2),
+        items=priced.lines,
+        total=priced.total,
         user=user,
         stripe_on=stripe_enabled(),
     )
@@ -1109,68 +4411,75 @@ def payment_submit():
 
 @app.route("/payment/success")
 def payment_success():
+    """Show the outcome of a Checkout from local state; the webhook creates the order."""
     username = session.get("username")
     session_id = request.args.get("session_id")
     if not username or not session_id or not stripe_enabled():
         return redirect(url_for("orders"))
-
-    try:
-        checkout_session = stripe.checkout.Session.retrieve(session_id)
-        payment_intent_id = checkout_session.get("payment_intent")
-        cart_items_meta = checkout_session.get("metadata", {}).get("cart_items", "")
-        cart_items = [pid for pid in cart_items_meta.split(",") if pid]
-
-        brand = None
-        last4 = None
-        if payment_intent_id:
-            pi = stripe.PaymentIntent.retrieve(payment_intent_id)
-            if pi.charges and pi.charges.data:
-                charge = pi.charges.data[0]
-                pm_details = charge.get("payment_method_details", {}).get("card", {})
-                brand = pm_details.get("brand")
-                last4 = pm_details.get("last4")
-        shipping_details = checkout_session.get("shipping") or {}
-        ship_addr = (shipping_details.get("address") or {})
-
-        if cart_items:
-            order = create_order(
-                username,
-                cart_items,
-                shipping={
-                    "name": shipping_details.get("name"),
-                    "line1": ship_addr.get("line1"),
-                    "line2": ship_addr.get("line2"),
-                    "city": ship_addr.get("city"),
-                    "state": ship_addr.get("state"),
-                    "zip": ship_addr.get("postal_code"),
-                },
-                card_info={
-                    "brand": brand,
-                    "last4": last4,
-                },
-                stripe_pid=checkout_session.get("payment_intent"),
-            )
-            if order:
-                cart_db[username] = []  # clear cart
-                session["order_flash"] = f"Order #{order['order_id']} placed successfully."
-    except Exception:
+    tries = int_arg("tries", 0, maximum=PAYMENT_PENDING_REFRESHES)
+
+    order = find_order_by_checkout_session(session_id)
+    if order is None and not STRIPE_WEBHOOK_SECRET:
+        # no webhook delivery configured (local development): finalize here
+        try:
+            with stripe_timer("checkout.session.retrieve"):
+                checkout_session = stripe.checkout.Session.retrieve(session_id)
+            if checkout_session.get("payment_status", "paid") == "paid":
+                finalize_checkout(checkout_session)
+        except Exception:
+            return redirect(url_for("orders"))
+        order = find_order_by_checkout_session(session_id)
+
+    if order is not None and order["username"] != username:
         return redirect(url_for("orders"))
-
+    if order is not None:
+        session.pop("pending_checkout", None)
+        session["order_flash"] = f"Order #{order['id']} placed successfully."
+
+    refresh_seconds = refresh_url = None
+    if order is None and tries < PAYMENT_PENDING_REFRESHES:
+        refresh_seconds = min(2 ** (tries + 1), PAYMENT_PENDING_MAX_DELAY)
+        refresh_url = url_for("payment_success", session_id=session_id, tries=tries + 1)
     return render_template(
         "payment_success.html",
         logged_in=True,
         username=username,
+        order_id=order["id"] if order else None,
+        pending=order is None,
+        refresh_seconds=refresh_seconds,
+        refresh_url=refresh_url,
     )
 
 
+@app.route("/stripe/webhook", methods=["POST"])
+def stripe_webhook():
+    """Receive Stripe events; paid Checkout Sessions become orders (idempotently)."""
+    if not STRIPE_WEBHOOK_SECRET:
+        return jsonify({"error": "webhook_not_configured"}), 404
+    payload = request.get_data(as_text=True)
+    try:
+        event = stripe.Webhook.construct_event(
+            payload, request.headers.get("Stripe-Signature", ""), STRIPE_WEBHOOK_SECRET
+        )
+    except (ValueError, stripe.error.SignatureVerificationError):
+        return jsonify({"error": "invalid_signature"}), 400
+
+    if event["type"] in CHECKOUT_PAID_EVENTS:
+        checkout_session = event["data"]["object"]
+        # delayed payment methods complete later with async_payment_succeeded
+        if checkout_session.get("payment_status") == "paid":
+            finalize_checkout(checkout_session)
+    return jsonify({"received": True})
+
+
 @app.route("/payment/checkout", methods=["POST"])
 def payment_checkout():
     username = session.get("username")
     if not username:
         return redirect(url_for("login"))
 
-    cart_items = list(user_cart(username))
-    if not cart_items:
+    priced = price_cart(get_cart(username))
+    if not priced:
         session["cart_flash"] = "Your cart is empty. Add items before paying."
         return redirect(url_for("cart"))
 
@@ -1190,9 +4499,10 @@ def payment_checkout():
         session["cart_flash"] = "Please provide a full shipping address."
         return redirect(url_for("payment"))
 
+    snapshot_id = create_checkout_snapshot(username, priced)
     checkout_url, err = create_stripe_checkout_session(
         username,
-        cart_items,
+        priced,
         {
             "name": ship_name,
             "line1": ship_line1,
@@ -1201,12 +4511,13 @@ def payment_checkout():
             "state": ship_state,
             "zip": ship_zip,
         },
+        snapshot_id,
     )
     if err or not checkout_url:
         session["cart_flash"] = "Stripe checkout failed: " + str(err)
         return redirect(url_for("payment"))
 
-    session["pending_cart_items"] = cart_items
+    session["pending_checkout"] = snapshot_id
     return redirect(checkout_url, code=303)
 
 
@@ -1240,12 +4551,25 @@ def cart_remove():
     return redirect(url_for("cart"))
 
 
+@app.route("/cart/decrement", methods=["POST"])
+def cart_decrement():
+    username = session.get("username")
+    if not username:
+        session["flash_msg"] = "Please log in to manage your cart."
+        return redirect(url_for("login"))
+
+    pid = request.form.get("pid", "").strip()
+    if not pid or not decrement_cart_item(username, pid):
+        session["cart_flash"] = "Could not update that item."
+    return redirect(url_for("cart"))
+
+
 @app.route("/cart/clear", methods=["POST"])
 def cart_clear():
     username = session.get("username")
     if not username:
         return redirect(url_for("login"))
-    cart_db[username] = []
+    clear_cart(username)
     session["cart_flash"] = "Cart cleared."
     return redirect(url_for("cart"))
 
@@ -1258,15 +4582,127 @@ def api_session():
     return jsonify({"logged_in": logged_in(), "username": current_user()})
 
 
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus scrape target for this worker's counters and histograms."""
+    return app.response_class(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/api/cache/stats")
+def api_cache_stats():
+    return jsonify(
+        {
+            "catalog": catalog_cache.stats(),
+            "shop_pages": shop_page_cache.stats(),
+            "suggest": suggest_index.stats(),
+            "fuzzy": fuzzy_index.stats(),
+        }
+    )
+
+
+# Serialized catalog responses are kept per catalog version, so kiosks
+# polling an unchanged catalog get a 304, or the cached (gzipped) body,
+# without touching the database or re-encoding JSON
+CATALOG_HTTP_MAX_AGE = int(os.getenv("CATALOG_HTTP_MAX_AGE", "60"))
+CATALOG_RESPONSE_CACHE_MAX = 256
+GZIP_MIN_SIZE = 1024
+
+
+def build_catalog_payload(args):
+    """Return the JSON-able catalog payload for normalized request args."""
+    if args is None:
+        return get_all_products()
+    after, limit, vehicle = args
+    items, next_cursor = fetch_products_page(after, limit=limit, vehicle=vehicle)
+    return {"items": items, "next_cursor": next_cursor, "limit": limit}
+
+
+def cached_catalog_body(args):
+    """Return (body, gzipped_body) for the current catalog version."""
+    responses = catalog_cache.derived("responses", dict)
+    key = json.dumps(args)
+    entry = responses.get(key)
+    if entry is None:
+        body = json.dumps(build_catalog_payload(args), separators=(",", ":")).encode()
+        gzipped = gzip.compress(body, 6) if len(body) >= GZIP_MIN_SIZE else None
+        entry = (body, gzipped)
+        # first pages and ?all=1 are what gets polled; don't hoard deep pages
+        if len(responses) < CATALOG_RESPONSE_CACHE_MAX:
+            responses[key] = entry
+    return entry
+
+
+def catalog_page_response():
+    """Paginated catalog JSON; ``?all=1`` keeps the legacy full-list shape.
+
+    Responses carry an ETag tied to the catalog version and answer
+    If-None-Match / If-Modified-Since with 304.
+    """
+    if request.args.get("all") in ("1", "true"):
+        args = None
+    else:
+        cursor = request.args.get("cursor")
+        after = decode_product_cursor(cursor)
+        if cursor and after is None:
+            return jsonify({"error": "invalid_cursor"}), 400
+        limit = int_arg("limit", PAGE_SIZE, minimum=1, maximum=PAGE_SIZE_MAX)
+        vehicle = request.args.get("vehicle", "").strip()
+        args = (after, limit, vehicle)
+
+    body, gzipped = cached_catalog_body(args)
+    use_gzip = gzipped is not None and request.accept_encodings["gzip"] > 0
+    response = app.response_class(gzipped if use_gzip else body, mimetype="application/json")
+    if use_gzip:
+        response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    response.set_etag(f"catalog-{catalog_cache.version}" + ("-gz" if use_gzip else ""))
+    response.last_modified = catalog_cache.updated_at
+    response.cache_control.public = True
+    response.cache_control.max_age = CATALOG_HTTP_MAX_AGE
+    response.cache_control.must_revalidate = True
+    return response.make_conditional(request)
+
+
 @app.route("/api/products")
 def api_products():
-    return jsonify(get_all_products())
+    return catalog_page_response()
 
 
 @app.route("/api/parts")
 def api_parts():
     # duplicate endpoint name for compatibility with earlier JS
-    return jsonify(get_all_products())
+    return catalog_page_response()
+
+
+@app.route("/api/suggest")
+def api_suggest():
+    """Typeahead completions for the shop search box."""
+    query = request.args.get("q", "")
+    limit = int_arg("limit", SUGGEST_LIMIT, minimum=1, maximum=SUGGEST_MAX_LIMIT)
+    suggest_index.refresh()
+    return jsonify({"query": query, "suggestions": suggest_index.lookup(query, limit)})
+
+
+@app.route("/api/search")
+def api_search():
+    query = request.args.get("q", "").strip()
+    vehicle = request.args.get("vehicle", "").strip()
+    limit = int_arg("limit", 20, minimum=1, maximum=SEARCH_MAX_LIMIT)
+    offset = int_arg("offset", 0)
+    results, total = search_products(query, vehicle, limit=limit, offset=offset)
+    corrected = None
+    if not total:
+        results, total, corrected = fuzzy_search_products(query, vehicle, limit=limit, offset=offset)
+    return jsonify(
+        {
+            "query": query,
+            "corrected": corrected,
+            "total": total,
+            "limit": limit,
+            "offset": offset,
+            "results": results,
+        }
+    )
 
 
 @app.route("/api/orders", methods=["GET", "POST"])
@@ -1275,17 +4711,27 @@ def api_orders():
     if not username:
         return jsonify({"error": "not_logged_in"}), 401
 
-    # GET: return JSON list of this user's orders
+    # GET: return one page of this user's orders, newest first
     if request.method == "GET":
-        return jsonify(fetch_orders(username))
-
-    # POST: create a new order from a list of product IDs
+        cursor = request.args.get("cursor")
+        before = decode_order_cursor(cursor)
+        if cursor and before is None:
+            return jsonify({"error": "invalid_cursor"}), 400
+        limit = int_arg("limit", ORDERS_PAGE_SIZE, minimum=1, maximum=ORDERS_PAGE_SIZE_MAX)
+        orders_page, next_cursor = fetch_orders(username, before=before, limit=limit)
+        return jsonify({"orders": orders_page, "next_cursor": next_cursor, "limit": limit})
+
+    # POST: create a new order from a list of product IDs (or {id: qty})
     data = request.get_json() or {}
+    if not isinstance(data, dict):
+        return jsonify({"error": "invalid_request"}), 400
     item_ids = data.get("items", [])
     if not item_ids:
         return jsonify({"error": "empty_cart"}), 400
+    if not valid_cart_items(item_ids):
+        return jsonify({"error": "invalid_items"}), 400
 
-    order = create_order(username, item_ids)
+    order = create_order(username, price_cart(item_ids))
     if not order:
         return jsonify({"error": "invalid_items"}), 400
 
@@ -1299,7 +4745,4 @@ def api_orders():
 # Main
 # -------------------------------------------------
 if __name__ == "__main__":
-    # Tables already initialized above, but safe to call again if needed
-    init_products_table()
-    init_users_table()
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1,237 @@
+"""Columnar catalog vs the old list of dicts: memory per SKU and filter latency.
+
+Usage (from the repository root):
+
+    python -m bench.catalog --parts 1000000
+    python -m bench.catalog --parts 200000 --repeat 50 --output catalog.json
+
+A synthetic catalog is written to an in-memory SQLite table and loaded
+both ways with the query CatalogCache uses: as ``[dict(r) for r in rows]``
+plus an id index (the previous cache), and as a ColumnarCatalog. Retained
+memory is measured with tracemalloc. The same shop queries are then
+answered by list comprehensions (what a dict-backed shop() would do) and
+by the columnar bitmaps, and the results are checked to be identical.
+"""
+
+import argparse
+import heapq
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+from bench.data import VEHICLES, generate_parts
+
+LIMIT = 24
+
+
+def build_source(parts, seed):
+    """In-memory products table shaped like the app's, with its browse index."""
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    conn.execute(
+        """
+        CREATE TABLE products (
+            id TEXT PRIMARY KEY, name TEXT NOT NULL, category TEXT, fitment TEXT,
+            price REAL NOT NULL, img TEXT, description TEXT
+        )
+        """
+    )
+    conn.executemany(
+        "INSERT INTO products VALUES (?, ?, ?, ?, ?, ?, ?)",
+        generate_parts(parts, random.Random(seed)),
+    )
+    conn.execute("CREATE INDEX idx_products_name_price_id ON products (name, price, id)")
+    return conn
+
+
+def fetch_rows(conn):
+    return conn.execute(
+        """
+        SELECT id, name, category, fitment, price, img, description
+        FROM products ORDER BY name, price, id
+        """
+    ).fetchall()
+
+
+def load_dicts(conn):
+    products = [dict(r) for r in fetch_rows(conn)]
+    return products, {p["id"]: p for p in products}
+
+
+def load_columnar(storefront, conn):
+    return storefront.ColumnarCatalog(fetch_rows(conn))
+
+
+def retained(load):
+    """Run ``load()`` twice: traced for retained bytes, then untraced for time.
+
+    Returns (result, bytes still allocated afterwards, seconds).
+    """
+    tracemalloc.start()
+    result = load()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    started = time.perf_counter()
+    load()
+    return result, size, time.perf_counter() - started
+
+
+def vehicle_ids(storefront, products, label):
+    """Ids fitting a vehicle, as the product_fitment lookup would return them."""
+    year, make, model = storefront.parse_vehicle(label)
+    return {
+        p["id"]
+        for p in products
+        if any(
+            (f["year"], f["make"], f["model"]) == (year, make, model)
+            for f in storefront.parse_fitment(p["fitment"])
+        )
+    }
+
+
+def scenarios(vehicle):
+    """(name, filters, sort) for the shop queries being compared."""
+    return [
+        ("browse all, by name", {}, "name"),
+        ("browse all, by price", {}, "price_asc"),
+        ("category", {"category": "Brakes"}, "name"),
+        ("price range", {"min_price": 50.0, "max_price": 150.0}, "name"),
+        ("category + price, by price", {"category": "Filters", "max_price": 80.0}, "price_asc"),
+        ("vehicle, by price desc", {"vehicle": vehicle}, "price_desc"),
+        ("vehicle + category + price", {"vehicle": vehicle, "category": "Brakes", "min_price": 100.0}, "name"),
+    ]
+
+
+def dict_query(products, vehicle_sets, filters, sort):
+    """First page and total the straightforward way: filter every dict, then pick."""
+    category = filters.get("category")
+    lo = filters.get("min_price")
+    hi = filters.get("max_price")
+    fits = vehicle_sets.get(filters.get("vehicle"))
+    matches = [
+        p for p in products
+        if (not category or p["category"] == category)
+        and (lo is None or p["price"] >= lo)
+        and (hi is None or p["price"] <= hi)
+        and (fits is None or p["id"] in fits)
+    ]
+    if sort == "name":
+        key = lambda p: (p["name"], p["price"], p["id"])
+    else:
+        key = lambda p: (p["price"], p["name"], p["id"])
+    pick = heapq.nlargest if sort == "price_desc" else heapq.nsmallest
+    return [p["id"] for p in pick(LIMIT, matches, key=key)], len(matches)
+
+
+def columnar_query(catalog, vehicle_masks, filters, sort):
+    mask = catalog.filter_mask(
+        filters.get("category"), filters.get("min_price"), filters.get("max_price"),
+        within=vehicle_masks.get(filters.get("vehicle")),
+    )
+    rows, _ = catalog.page(mask, sort, None, LIMIT)
+    return [catalog.row(i)["id"] for i in rows], mask.bit_count()
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return result, {
+        "p50_ms": round(samples[len(samples) // 2] * 1000, 3),
+        "max_ms": round(samples[-1] * 1000, 3),
+    }
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--parts", type=int, default=1_000_000, help="synthetic catalog size")
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs per query")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="JSON results path (default bench/results/catalog-<timestamp>.json)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.environ.setdefault("PROFILE_SAMPLE_RATE", "0")
+    import app as storefront
+
+    print(f"Generating {args.parts} parts ...")
+    conn = build_source(args.parts, args.seed)
+
+    (products, by_id), dict_bytes, dict_seconds = retained(lambda: load_dicts(conn))
+    catalog, columnar_bytes, columnar_seconds = retained(lambda: load_columnar(storefront, conn))
+    memory = {
+        "dicts_bytes_per_sku": round(dict_bytes / args.parts, 1),
+        "columnar_bytes_per_sku": round(columnar_bytes / args.parts, 1),
+        "dicts_load_seconds": round(dict_seconds, 2),
+        "columnar_load_seconds": round(columnar_seconds, 2),
+    }
+    print(
+        f"  memory per SKU: list of dicts {memory['dicts_bytes_per_sku']} B, "
+        f"columnar {memory['columnar_bytes_per_sku']} B "
+        f"({dict_bytes / max(columnar_bytes, 1):.1f}x smaller)"
+    )
+    print(
+        f"  load from SQLite: list of dicts {memory['dicts_load_seconds']}s, "
+        f"columnar {memory['columnar_load_seconds']}s"
+    )
+
+    make, model = VEHICLES[0]
+    vehicle = f"2012 {make} {model}"
+    fits = vehicle_ids(storefront, products, vehicle)
+    vehicle_sets = {vehicle: fits}
+    # the shop caches vehicle bitmaps (vehicle_mask_cache), so build it up front
+    vehicle_masks = {vehicle: catalog.ids_mask(fits)}
+
+    results = []
+    print(f"\n  {'query':<30}{'matches':>9}{'dicts p50':>12}{'columnar p50':>14}{'speedup':>9}")
+    for name, filters, sort in scenarios(vehicle):
+        expected, dict_timing = timed(lambda: dict_query(products, vehicle_sets, filters, sort), args.repeat)
+        got, columnar_timing = timed(lambda: columnar_query(catalog, vehicle_masks, filters, sort), args.repeat)
+        if got != expected:
+            raise SystemExit(f"{name}: columnar result differs from the list of dicts")
+        speedup = dict_timing["p50_ms"] / max(columnar_timing["p50_ms"], 1e-6)
+        results.append(
+            {"query": name, "sort": sort, "matches": expected[1],
+             "dicts": dict_timing, "columnar": columnar_timing, "speedup": round(speedup, 1)}
+        )
+        print(
+            f"  {name:<30}{expected[1]:>9}{dict_timing['p50_ms']:>12}"
+            f"{columnar_timing['p50_ms']:>14}{speedup:>8.1f}x"
+        )
+
+    report = {
+        "meta": {
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "memory": memory,
+        "queries": results,
+    }
+    output = args.output or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "results",
+        "catalog-" + datetime.now().strftime("%Y%m%d-%H%M%S") + ".json",
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, indent=2)
+    print(f"\nResults written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
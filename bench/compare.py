@@ -0,0 +1,53 @@
+"""Compare two bench.run result files route by route.
+
+    python -m bench.compare bench/results/before.json bench/results/after.json
+"""
+
+import argparse
+import json
+import sys
+
+METRICS = ("throughput_rps", "p50_ms", "p95_ms", "p99_ms")
+
+
+def load(path):
+    with open(path, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def change(old, new):
+    if not old:
+        return "    n/a"
+    return f"{(new - old) / old * 100:+6.1f}%"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    args = parser.parse_args(argv)
+    before, after = load(args.before), load(args.after)
+
+    print(f"before: {args.before} ({before['meta'].get('git_revision')})")
+    print(f"after:  {args.after} ({after['meta'].get('git_revision')})")
+    for mode, new in after["modes"].items():
+        old = before["modes"].get(mode)
+        if old is None:
+            continue
+        print(f"\n[{mode}] throughput {old['throughput_rps']} -> {new['throughput_rps']} req/s "
+              f"({change(old['throughput_rps'], new['throughput_rps'])})")
+        print(f"  {'route':<16}" + "".join(f"{m:>24}" for m in METRICS[1:]))
+        for route, new_route in new["routes"].items():
+            old_route = old["routes"].get(route)
+            if old_route is None:
+                continue
+            cells = "".join(
+                f"{old_route[m]:>8} -> {new_route[m]:<7}{change(old_route[m], new_route[m])}"
+                for m in METRICS[1:]
+            )
+            print(f"  {route:<16}{cells}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
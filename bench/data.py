@@ -0,0 +1,134 @@
+"""Synthetic catalog, users and order histories for benchmark runs.
+
+Parts and orders are written through the app's own helpers (catalog
+upsert, fitment sync, create_order) so the generated database has the same
+shape, indexes and triggers as production. Users are inserted with one
+batched INSERT through the app's write queue rather than register_user(),
+so the shared password is hashed once instead of once per user.
+Generation is deterministic for a given seed.
+"""
+
+import random
+import time
+
+from werkzeug.security import generate_password_hash
+
+CATEGORIES = {
+    "Brakes": ["Brake Pads", "Brake Rotor", "Brake Caliper", "Brake Line"],
+    "Filters": ["Oil Filter", "Air Filter", "Cabin Air Filter", "Fuel Filter"],
+    "Electrical": ["Alternator", "Starter Motor", "Battery", "Ignition Coil"],
+    "Ignition": ["Spark Plug", "Spark Plug Wire Set", "Distributor Cap"],
+    "Belts": ["Serpentine Belt", "Timing Belt", "Belt Tensioner"],
+    "Cooling": ["Radiator", "Water Pump", "Thermostat", "Radiator Hose"],
+    "Suspension": ["Strut Assembly", "Shock Absorber", "Control Arm", "Sway Bar Link"],
+    "Lighting": ["Headlight Bulb", "Tail Light Assembly", "Fog Light"],
+    "Wipers": ["Wiper Blade", "Rear Wiper Arm"],
+}
+QUALIFIERS = ["Ceramic", "Premium", "Heavy Duty", "OEM", "Performance", "Economy", "Platinum", "Iridium"]
+VEHICLES = [
+    ("Honda", "Civic"), ("Honda", "Accord"), ("Toyota", "Corolla"), ("Toyota", "Camry"),
+    ("Ford", "F-150"), ("Ford", "Focus"), ("Chevrolet", "Silverado"), ("Chevrolet", "Malibu"),
+    ("Nissan", "Altima"), ("Nissan", "Sentra"), ("Jeep", "Wrangler"), ("Subaru", "Outback"),
+]
+ENGINES = ["1.5L", "1.8L", "2.0L", "2.4L", "2.5L", "3.5L", "5.0L", "V6", "V8"]
+POSITIONS = ["", "front", "rear", "front left", "front right"]
+
+BENCH_PASSWORD = "bench-password"
+
+
+def search_terms():
+    """Words that occur in generated part names, for the search step."""
+    names = [name for names in CATEGORIES.values() for name in names]
+    return sorted({word.lower() for name in names for word in name.split()} | {"filter", "brake"})
+
+
+def generate_parts(count, rng):
+    """Yield product rows in CATALOG_FIELDS order."""
+    categories = list(CATEGORIES)
+    for n in range(count):
+        category = categories[n % len(categories)]
+        part = rng.choice(CATEGORIES[category])
+        qualifier = rng.choice(QUALIFIERS)
+        year = rng.randint(2005, 2022)
+        make, model = rng.choice(VEHICLES)
+        detail = " ".join(filter(None, [rng.choice(ENGINES), rng.choice(POSITIONS)]))
+        fitment = f"{year} {make} {model} – {detail}"
+        if rng.random() < 0.3:
+            year2 = min(year + rng.randint(1, 3), 2023)
+            fitment += f"; {year2} {make} {model}"
+        yield (
+            f"bench-{n:07d}",
+            f"{qualifier} {part}",
+            category,
+            fitment,
+            round(rng.uniform(4.99, 899.99), 2),
+            None,
+            f"{qualifier} {part.lower()} for {make} {model}.",
+        )
+
+
+def seed_catalog(storefront, count, rng, batch_size=5000):
+    """Bulk upsert ``count`` synthetic parts; returns their ids."""
+    ids = []
+    batch = []
+    for row in generate_parts(count, rng):
+        batch.append(row)
+        ids.append(row[0])
+        if len(batch) >= batch_size:
+            storefront.run_write("catalog", lambda conn, rows=batch: storefront.upsert_products(conn, rows))
+            batch = []
+    if batch:
+        storefront.run_write("catalog", lambda conn, rows=batch: storefront.upsert_products(conn, rows))
+    return ids
+
+
+def seed_users(storefront, count):
+    """Create bench users sharing one password; returns their usernames."""
+    # hash once: per-user hashing would dominate setup time
+    password_hash = generate_password_hash(BENCH_PASSWORD)
+    usernames = [f"bench-user-{n:05d}" for n in range(count)]
+
+    def write(conn):
+        conn.executemany(
+            """
+            INSERT OR IGNORE INTO users (username, email, password_hash, display_name)
+            VALUES (?, ?, ?, ?)
+            """,
+            [(u, f"{u}@bench.invalid", password_hash, u) for u in usernames],
+        )
+
+    storefront.run_write("users", write)
+    return usernames
+
+
+def seed_orders(storefront, usernames, part_ids, per_user, rng):
+    """Give every user ``per_user`` past orders of 1-4 random parts."""
+    shipping = {"name": "Bench", "line1": "1 Test St", "city": "Testville", "state": "CA", "zip": "90000"}
+    card = {"brand": "visa", "last4": "4242"}
+    created = 0
+    for username in usernames:
+        for _ in range(per_user):
+            quantities = {pid: rng.randint(1, 3) for pid in rng.sample(part_ids, rng.randint(1, 4))}
+            storefront.create_order(username, storefront.price_cart(quantities), shipping, card)
+            created += 1
+    return created
+
+
+def build_dataset(storefront, parts, users, orders_per_user, seed):
+    """Populate the app's (empty, scratch) database and describe what was made."""
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    with storefront.app.app_context():
+        storefront.ensure_schema()
+        part_ids = seed_catalog(storefront, parts, rng)
+        usernames = seed_users(storefront, users)
+        orders = seed_orders(storefront, usernames, part_ids, orders_per_user, rng)
+    return {
+        "parts": len(part_ids),
+        "users": len(usernames),
+        "orders": orders,
+        "seed_seconds": round(time.perf_counter() - started, 2),
+        "part_ids": part_ids,
+        "usernames": usernames,
+        "search_terms": search_terms(),
+    }
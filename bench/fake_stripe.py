@@ -0,0 +1,100 @@
+"""In-process stand-in for the Stripe API calls the checkout flow makes.
+
+Installing it patches the stripe module the app imported, so no request
+leaves the machine and every checkout "succeeds" with a test card.
+"""
+
+import itertools
+import json
+import threading
+
+
+class StripeObject(dict):
+    """Dict with attribute access, like stripe.StripeObject."""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class FakeStripe:
+    CHECKOUT_URL = "https://checkout.stripe.test/pay/"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.sessions = {}
+        self.calls = 0
+
+    def install(self, storefront):
+        """Patch the app's stripe module and mark Stripe as configured."""
+        stripe = storefront.stripe
+        stripe.checkout.Session.create = staticmethod(self.create_session)
+        stripe.checkout.Session.retrieve = staticmethod(self.retrieve_session)
+        stripe.PaymentIntent.create = staticmethod(self.create_payment_intent)
+        stripe.PaymentIntent.retrieve = staticmethod(self.retrieve_payment_intent)
+        storefront.STRIPE_SECRET_KEY = "sk_test_bench"
+        stripe.api_key = "sk_test_bench"
+
+    def _next_id(self, prefix):
+        with self._lock:
+            self.calls += 1
+            return f"{prefix}_bench_{next(self._ids)}"
+
+    def create_session(self, **params):
+        session_id = self._next_id("cs")
+        session = StripeObject(
+            id=session_id,
+            url=self.CHECKOUT_URL + session_id,
+            payment_intent="pi" + session_id[2:],
+            payment_status="paid",
+            metadata=params.get("metadata") or {},
+            amount_total=sum(
+                item["price_data"]["unit_amount"] * item["quantity"]
+                for item in params.get("line_items", [])
+            ),
+            shipping=StripeObject(
+                name="Bench Shopper",
+                address={"line1": "1 Test St", "line2": "", "city": "Testville",
+                         "state": "CA", "postal_code": "90000"},
+            ),
+        )
+        with self._lock:
+            self.sessions[session_id] = session
+        return session
+
+    def retrieve_session(self, session_id, **params):
+        with self._lock:
+            self.calls += 1
+            return self.sessions[session_id]
+
+    def create_payment_intent(self, **params):
+        return StripeObject(id=self._next_id("pi"), status="succeeded", amount=params.get("amount"))
+
+    def retrieve_payment_intent(self, intent_id, **params):
+        with self._lock:
+            self.calls += 1
+        card = {"payment_method_details": {"card": {"brand": "visa", "last4": "4242"}}}
+        return StripeObject(id=intent_id, charges=StripeObject(data=[card]))
+
+    def completed_event(self, session_id, sign, secret):
+        """Return (payload, Stripe-Signature) for the session's completion event."""
+        with self._lock:
+            session = self.sessions[session_id]
+        payload = json.dumps(
+            {
+                "id": "evt" + session_id[2:],
+                "object": "event",
+                "type": "checkout.session.completed",
+                "data": {"object": session},
+            }
+        )
+        return payload, sign(payload, secret)
+
+    @classmethod
+    def session_id_from_url(cls, url):
+        if not url or not url.startswith(cls.CHECKOUT_URL):
+            return None
+        return url[len(cls.CHECKOUT_URL):]
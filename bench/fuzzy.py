@@ -0,0 +1,198 @@
+"""Typo-tolerant search latency against a fixed budget.
+
+Usage (from the repository root):
+
+    python -m bench.fuzzy --parts 200000
+    python -m bench.fuzzy --parts 1000000 --budget-ms 50
+
+A synthetic catalog is loaded into an in-memory SQLite database with the
+app's FTS index and change log. Every part name gets a made-up brand word
+as well, so the vocabulary grows with the catalog the way real brand and
+product-line names make it grow. Queries are real catalog words with one
+typo (a letter dropped, doubled, swapped or replaced), alone or next to a
+correctly spelled word; correction accuracy is reported per word source.
+Each one goes through fuzzy_search_products(), the shop's fallback, and
+the run fails if p99 latency is over the budget.
+Finally a batch of catalog_changes rows is replayed to time incremental
+maintenance.
+"""
+
+import argparse
+import bisect
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+
+from bench.data import CATEGORIES, VEHICLES, generate_parts
+from bench.suggest import change_rows
+
+SYLLABLES = [
+    "ka", "lo", "ven", "tri", "mar", "dex", "su", "ro", "pel", "zan", "qui", "nor",
+    "bel", "tor", "vi", "gra", "mon", "sil", "fa", "ex", "lu", "cor", "den", "ta",
+]
+
+
+def brand(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+
+
+def build_source(storefront, parts, rng):
+    """In-memory catalog database with products, products_fts and catalog_changes."""
+    conn = sqlite3.connect(":memory:", isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute(
+        """
+        CREATE TABLE products (
+            id TEXT PRIMARY KEY, name TEXT NOT NULL, category TEXT, fitment TEXT,
+            price REAL NOT NULL, img TEXT, description TEXT
+        )
+        """
+    )
+    conn.execute("BEGIN")
+    conn.executemany(
+        "INSERT INTO products VALUES (?, ?, ?, ?, ?, ?, ?)",
+        ((p[0], f"{brand(rng)} {p[1]}", *p[2:]) for p in generate_parts(parts, rng)),
+    )
+    conn.execute("COMMIT")
+    cur = conn.cursor()
+    storefront.migration_products_fts(cur)
+    storefront.migration_catalog_changes(cur)
+    return conn
+
+
+def typo(rng, word):
+    i = rng.randrange(len(word))
+    edit = rng.choice(("drop", "double", "swap", "replace"))
+    if edit == "drop":
+        return word[:i] + word[i + 1:]
+    if edit == "double":
+        return word[:i] + word[i] + word[i:]
+    if edit == "swap" and i < len(word) - 1:
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    return word[:i] + rng.choice("abcdefghijklmnopqrstuvwxyz") + word[i + 1:]
+
+
+def queries(rng, words, count, vocabulary):
+    """(query, intended word) pairs, each query with one misspelled word.
+
+    Misspellings that are a prefix of some catalog word are skipped: the
+    shop's exact search matches those, so they never reach the fallback.
+    """
+    pairs = []
+    while len(pairs) < count:
+        word = rng.choice(words)
+        misspelled = typo(rng, word)
+        i = bisect.bisect_left(vocabulary, misspelled)
+        if len(misspelled) < 4 or (i < len(vocabulary) and vocabulary[i].startswith(misspelled)):
+            continue
+        query = misspelled
+        if rng.random() < 0.3:
+            query = f"{misspelled} {rng.choice(words)}"
+        pairs.append((query, word))
+    return pairs
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda f: round(samples[min(len(samples) - 1, int(f * len(samples)))] * 1000, 3)
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99),
+            "max_ms": round(samples[-1] * 1000, 3)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--parts", type=int, default=200_000)
+    parser.add_argument("--queries", type=int, default=2_000)
+    parser.add_argument("--changes", type=int, default=3_000)
+    parser.add_argument("--budget-ms", type=float, default=50.0, help="p99 latency budget")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="also write the results as JSON here")
+    args = parser.parse_args(argv)
+    os.environ.setdefault("PROFILE_SAMPLE_RATE", "0")
+    import app as storefront
+    from flask import g
+
+    rng = random.Random(args.seed)
+    print(f"Loading {args.parts} parts ...")
+    conn = build_source(storefront, args.parts, rng)
+    index = storefront.fuzzy_index
+    started = time.perf_counter()
+    index.build(conn.execute("SELECT name, category, fitment FROM products"))
+    index.seq = 0
+    build_seconds = time.perf_counter() - started
+    stats = index.stats()
+    print(f"  trigram index: {stats['words']} words, {stats['posting_lists']} posting lists, built in {build_seconds:.2f}s")
+
+    catalog_words = {
+        word.lower()
+        for text in [*CATEGORIES, *(n for names in CATEGORIES.values() for n in names),
+                     *(f"{make} {model}" for make, model in VEHICLES)]
+        for word in text.split()
+    }
+    vocabulary = sorted(index._ids)
+    brands = [word for word in vocabulary if word not in catalog_words]
+    words = sorted(w for w in catalog_words if storefront.correctable(w))
+    # half catalog words, half brands: most typos land in the long tail
+    sets = {
+        "catalog words": queries(rng, words, args.queries // 2, vocabulary),
+        "brands": queries(rng, brands, args.queries - args.queries // 2, vocabulary),
+    }
+
+    samples, accuracy = [], {}
+    with storefront.app.app_context():
+        g.dbs = {"catalog": conn}
+        try:
+            for label, pairs in sets.items():
+                found = corrected_right = 0
+                for query, intended in pairs:
+                    started = time.perf_counter()
+                    _, total, corrected = storefront.fuzzy_search_products(query, limit=storefront.PAGE_SIZE)
+                    samples.append(time.perf_counter() - started)
+                    found += bool(total)
+                    corrected_right += bool(corrected) and corrected.split()[0] == intended
+                accuracy[label] = {
+                    "found_rate": round(found / len(pairs), 4),
+                    "corrected_rate": round(corrected_right / len(pairs), 4),
+                }
+        finally:
+            g.pop("dbs")
+
+    latency = percentiles(samples)
+    within = latency["p99_ms"] <= args.budget_ms
+    print(f"  {len(samples)} misspelled queries: p50 {latency['p50_ms']} ms, p95 {latency['p95_ms']} ms, "
+          f"p99 {latency['p99_ms']} ms, max {latency['max_ms']} ms")
+    for label, rates in accuracy.items():
+        print(f"  {label}: found results for {rates['found_rate']:.1%}, "
+              f"corrected to the intended word {rates['corrected_rate']:.1%}")
+    print(f"  p99 {'within' if within else 'OVER'} the {args.budget_ms} ms budget")
+
+    sample = conn.execute("SELECT id, name, category, fitment FROM products ORDER BY random() LIMIT 1000").fetchall()
+    changes = change_rows(rng, sample, args.changes)
+    started = time.perf_counter()
+    index.apply(changes)
+    apply_seconds = time.perf_counter() - started
+    per_change_ms = round(apply_seconds / len(changes) * 1000, 4)
+    print(f"  incremental: {len(changes)} changes in {apply_seconds:.3f}s ({per_change_ms} ms each)")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump(
+                {
+                    "args": vars(args),
+                    "index": {**stats, "build_seconds": round(build_seconds, 3)},
+                    "latency": latency,
+                    "accuracy": accuracy,
+                    "change_ms": per_change_ms,
+                    "within_budget": within,
+                },
+                fh,
+                indent=2,
+            )
+    return 0 if within else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,333 @@
+"""Drive the storefront through its customer flows and report latency.
+
+Usage (from the repository root):
+
+    python -m bench.run --parts 10000 --users 50 --threads 8 --flows 25
+    python -m bench.run --mode http --parts 1000000 --output results.json
+
+A throwaway data directory is seeded with a synthetic catalog, users and
+order histories, then every worker thread repeatedly runs
+
+    browse -> search -> product -> cart add/remove -> checkout -> webhook -> orders
+
+against the real Flask app, either through the test client (no network,
+measures the app itself) or over HTTP against a threaded werkzeug server.
+Stripe is replaced by bench.fake_stripe. Per-route throughput and
+p50/p95/p99 latency are printed and written as JSON for bench.compare.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from bench.data import BENCH_PASSWORD, build_dataset
+from bench.fake_stripe import FakeStripe
+
+SHIPPING_FORM = {
+    "ship_name": "Bench Shopper",
+    "ship_line1": "1 Test St",
+    "ship_city": "Testville",
+    "ship_state": "CA",
+    "ship_zip": "90000",
+}
+
+
+class TestClientDriver:
+    """Requests through Flask's test client: app cost only, no sockets."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, form=None, body=None, headers=None):
+        response = self.client.open(
+            path, method=method, data=form if body is None else body, headers=headers
+        )
+        return response.status_code, response.headers.get("Location"), response.data
+
+
+class HTTPDriver:
+    """Requests over a keep-alive HTTP connection, with its own cookie."""
+
+    def __init__(self, host, port):
+        self.conn = http.client.HTTPConnection(host, port, timeout=60)
+        self.cookie = None
+
+    def request(self, method, path, form=None, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.cookie:
+            headers["Cookie"] = self.cookie
+        if form is not None:
+            body = urlencode(form)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        self.conn.request(method, path, body=body, headers=headers)
+        response = self.conn.getresponse()
+        data = response.read()
+        set_cookie = response.getheader("Set-Cookie")
+        if set_cookie:
+            self.cookie = set_cookie.split(";", 1)[0]
+        return response.status, response.getheader("Location"), data
+
+    def close(self):
+        self.conn.close()
+
+
+class Recorder:
+    """Collects (route, seconds, ok) samples from all worker threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+
+    def add(self, route, seconds, ok):
+        with self._lock:
+            self.samples.setdefault(route, []).append(seconds)
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(recorder, wall_seconds):
+    routes = {}
+    total = 0
+    for route, samples in sorted(recorder.samples.items()):
+        samples.sort()
+        total += len(samples)
+        routes[route] = {
+            "count": len(samples),
+            "errors": recorder.errors.get(route, 0),
+            "throughput_rps": round(len(samples) / wall_seconds, 2),
+            "mean_ms": round(sum(samples) / len(samples) * 1000, 3),
+            "p50_ms": round(percentile(samples, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(samples, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(samples, 0.99) * 1000, 3),
+            "max_ms": round(samples[-1] * 1000, 3),
+        }
+    return {
+        "wall_seconds": round(wall_seconds, 3),
+        "requests": total,
+        "throughput_rps": round(total / wall_seconds, 2),
+        "errors": sum(recorder.errors.values()),
+        "routes": routes,
+    }
+
+
+def run_flows(driver, recorder, username, dataset, flows, rng, stripe_events):
+    """One virtual shopper: log in, then run the purchase flow ``flows`` times.
+
+    After each checkout the fake Stripe's signed checkout.session.completed
+    event is delivered to the webhook, as Stripe would, before the shopper
+    lands on the success page.
+    """
+
+    def step(route, method, path, form=None, expect=(200, 302, 303), **extra):
+        started = time.perf_counter()
+        try:
+            status, location, body = driver.request(method, path, form, **extra)
+        except Exception:
+            recorder.add(route, time.perf_counter() - started, False)
+            raise
+        recorder.add(route, time.perf_counter() - started, status in expect)
+        return status, location, body
+
+    step("login", "POST", "/login", {"username": username, "password": BENCH_PASSWORD})
+    part_ids = dataset["part_ids"]
+    terms = dataset["search_terms"]
+    for _ in range(flows):
+        step("browse", "GET", "/")
+        step("search", "GET", "/?" + urlencode({"q": rng.choice(terms)}))
+        picks = rng.sample(part_ids, 3)
+        step("product", "GET", f"/product/{picks[0]}")
+        for pid in picks:
+            step("cart_add", "POST", "/cart/add", {"pid": pid})
+        step("cart_remove", "POST", "/cart/remove", {"pid": picks[-1]})
+        step("cart", "GET", "/cart")
+        _, location, _ = step("checkout", "POST", "/payment/checkout", SHIPPING_FORM, expect=(303,))
+        session_id = FakeStripe.session_id_from_url(location)
+        if session_id:
+            payload, signature = stripe_events(session_id)
+            step(
+                "webhook", "POST", "/stripe/webhook", expect=(200,), body=payload,
+                headers={"Stripe-Signature": signature, "Content-Type": "application/json"},
+            )
+            step("payment_success", "GET", "/payment/success?" + urlencode({"session_id": session_id}))
+        step("orders", "GET", "/orders")
+
+
+def run_mode(mode, storefront, dataset, threads, flows, seed, stripe_events):
+    """Run ``threads`` concurrent shoppers against the app; return the summary."""
+    recorder = Recorder()
+    server = None
+    if mode == "http":
+        class Handler(WSGIRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like a real client
+
+            def log_request(self, *args, **kwargs):
+                pass
+
+        server = make_server("127.0.0.1", 0, storefront.app, threaded=True, request_handler=Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    usernames = dataset["usernames"]
+    failures = []
+
+    def worker(n):
+        rng = random.Random(seed * 1000 + n)
+        if server is not None:
+            driver = HTTPDriver("127.0.0.1", server.server_port)
+        else:
+            driver = TestClientDriver(storefront.app)
+        try:
+            run_flows(
+                driver, recorder, usernames[n % len(usernames)], dataset, flows, rng, stripe_events
+            )
+        except Exception as exc:
+            failures.append(f"worker {n}: {exc!r}")
+        finally:
+            if server is not None:
+                driver.close()
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    wall = time.perf_counter() - started
+    if server is not None:
+        server.shutdown()
+
+    result = summarize(recorder, wall)
+    result.update({"threads": threads, "flows_per_thread": flows, "failures": failures})
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_summary(mode, result):
+    print(
+        f"\n[{mode}] {result['requests']} requests in {result['wall_seconds']}s "
+        f"({result['throughput_rps']} req/s, {result['errors']} errors, {result['threads']} threads)"
+    )
+    print(f"  {'route':<16}{'count':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for route, r in result["routes"].items():
+        print(
+            f"  {route:<16}{r['count']:>8}{r['throughput_rps']:>10}{r['p50_ms']:>10}"
+            f"{r['p95_ms']:>10}{r['p99_ms']:>10}{r['errors']:>8}"
+        )
+    for failure in result["failures"]:
+        print(f"  ! {failure}")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--parts", type=int, default=10_000, help="synthetic catalog size")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--orders-per-user", type=int, default=5)
+    parser.add_argument("--mode", choices=["client", "http", "both"], default="both")
+    parser.add_argument("--threads", type=int, default=8, help="concurrent shoppers")
+    parser.add_argument("--flows", type=int, default=20, help="purchase flows per shopper")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="JSON results path (default bench/results/<timestamp>.json)")
+    parser.add_argument("--data-dir", help="seed into this directory instead of a temp dir")
+    parser.add_argument("--keep-data", action="store_true", help="don't delete the seeded data dir")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="valley-bench-")
+    os.makedirs(data_dir, exist_ok=True)
+
+    # configure the app before it is imported: paths and knobs are read at import
+    os.environ["VALLEY_DATA_DIR"] = data_dir
+    os.environ.setdefault("STRIPE_SECRET_KEY", "sk_test_bench")
+    os.environ.setdefault("STRIPE_WEBHOOK_SECRET", "whsec_bench")
+    os.environ.setdefault("PROFILE_SAMPLE_RATE", "0")
+    os.environ.setdefault("SLOW_REQUEST_MS", "0")
+    # every shopper logs in from 127.0.0.1; don't let auth throttling cap them
+    os.environ.setdefault("AUTH_ATTEMPTS_PER_IP", "0")
+    os.environ.setdefault("AUTH_ATTEMPTS_PER_USER", "0")
+    import app as storefront
+
+    fake_stripe = FakeStripe()
+    fake_stripe.install(storefront)
+    try:
+        print(f"Seeding {args.parts} parts, {args.users} users into {data_dir} ...")
+        dataset = build_dataset(
+            storefront, args.parts, args.users, args.orders_per_user, args.seed
+        )
+        print(f"  done in {dataset['seed_seconds']}s ({dataset['orders']} orders)")
+
+        modes = ["client", "http"] if args.mode == "both" else [args.mode]
+        results = {}
+        for mode in modes:
+            results[mode] = run_mode(
+                mode, storefront, dataset, args.threads, args.flows, args.seed,
+                lambda session_id: fake_stripe.completed_event(
+                    session_id, storefront.sign_webhook_payload, storefront.STRIPE_WEBHOOK_SECRET
+                ),
+            )
+            print_summary(mode, results[mode])
+    finally:
+        for database in storefront.DATABASES.values():
+            database.pool.close_all()
+        if not args.keep_data and not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "dataset": {k: dataset[k] for k in ("parts", "users", "orders", "seed_seconds")},
+        "modes": results,
+    }
+    output = args.output or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "results",
+        datetime.now().strftime("%Y%m%d-%H%M%S") + ".json",
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, indent=2)
+    print(f"\nResults written to {output}")
+    return 1 if any(r["errors"] or r["failures"] for r in results.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+"""Typeahead index latency: build, per-keystroke lookup and incremental updates.
+
+Usage (from the repository root):
+
+    python -m bench.suggest --parts 200000
+    python -m bench.suggest --parts 1000000 --lookups 50000
+
+The SuggestIndex is built from a synthetic catalog, with a unique model
+number appended to each part name as real catalogs have, then queried
+with every prefix (1-12 characters) a shopper would type on the way to
+real part names, categories and vehicles. Lookup time includes JSON encoding of
+the response, i.e. the server-side work of /api/suggest minus Flask's
+routing. Finally a batch of catalog_changes rows (renames, inserts and
+deletes) is replayed to time incremental maintenance.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+from bench.data import VEHICLES, generate_parts
+
+
+def prefixes(rng, parts, count):
+    """Keystroke prefixes of names, categories and vehicles, as typed."""
+    targets = []
+    for _ in range(count // 6 + 1):
+        part = rng.choice(parts)
+        make, model = rng.choice(VEHICLES)
+        name_words = part[1].split()
+        targets += [part[1], part[2], f"{make} {model}", model, name_words[-2], name_words[-1]]
+    typed = []
+    for target in targets:
+        for n in range(1, min(len(target), 12) + 1):
+            typed.append(target[:n])
+    rng.shuffle(typed)
+    return typed[:count]
+
+
+def change_rows(rng, parts, count):
+    """catalog_changes-shaped rows: a mix of renames, new parts and deletions."""
+    rows = []
+    for n in range(count):
+        part = rng.choice(parts)
+        kind = n % 3
+        if kind == 0:
+            rows.append((part[1], part[2], part[3], part[1] + " Plus", part[2], part[3]))
+        elif kind == 1:
+            rows.append((None, None, None, f"Bench Widget {n}", part[2], part[3]))
+        else:
+            rows.append((part[1], part[2], part[3], None, None, None))
+    return rows
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda f: round(samples[min(len(samples) - 1, int(f * len(samples)))] * 1000, 4)
+    return {"p50_ms": pick(0.50), "p99_ms": pick(0.99), "max_ms": round(samples[-1] * 1000, 4)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--parts", type=int, default=200_000)
+    parser.add_argument("--lookups", type=int, default=20_000)
+    parser.add_argument("--changes", type=int, default=3_000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="also write the results as JSON here")
+    args = parser.parse_args(argv)
+    os.environ.setdefault("PROFILE_SAMPLE_RATE", "0")
+    import app as storefront
+
+    rng = random.Random(args.seed)
+    parts = [
+        (p[0], f"{p[1]} {rng.choice('ABCDEFGHJKMNPRSTVX')}{n:06d}", *p[2:])
+        for n, p in enumerate(generate_parts(args.parts, rng))
+    ]
+    index = storefront.SuggestIndex()
+    started = time.perf_counter()
+    index.build((p[1], p[2], p[3]) for p in parts)
+    build_seconds = time.perf_counter() - started
+    keys = sum(len(entries) for entries in index._keys.values())
+    print(f"Built index over {args.parts} parts in {build_seconds:.2f}s ({keys} keys)")
+
+    samples = []
+    for prefix in prefixes(rng, parts, args.lookups):
+        started = time.perf_counter()
+        json.dumps({"query": prefix, "suggestions": index.lookup(prefix, storefront.SUGGEST_LIMIT)})
+        samples.append(time.perf_counter() - started)
+    lookup = percentiles(samples)
+    print(f"  lookup ({len(samples)} keystrokes): p50 {lookup['p50_ms']} ms, "
+          f"p99 {lookup['p99_ms']} ms, max {lookup['max_ms']} ms")
+
+    changes = change_rows(rng, parts, args.changes)
+    started = time.perf_counter()
+    index.apply(changes)
+    apply_seconds = time.perf_counter() - started
+    per_change_ms = round(apply_seconds / len(changes) * 1000, 4)
+    print(f"  incremental: {len(changes)} changes in {apply_seconds:.3f}s ({per_change_ms} ms each)")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump(
+                {
+                    "args": vars(args),
+                    "build_seconds": round(build_seconds, 3),
+                    "keys": keys,
+                    "lookup": lookup,
+                    "change_ms": per_change_ms,
+                },
+                fh,
+                indent=2,
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
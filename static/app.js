@@ -30,8 +30,41 @@ function mirrorLoginToLocalStorage() {
   });
 }
 
+// ---------- SEARCH TYPEAHEAD ----------
+function attachSearchSuggestions() {
+  const input = document.getElementById("search");
+  const list = document.getElementById("search-suggestions");
+  if (!input || !list || !input.dataset.suggestUrl) return;
+
+  let latest = 0;
+  input.addEventListener("input", async () => {
+    const q = input.value.trim();
+    const request = ++latest;
+    if (!q) {
+      list.replaceChildren();
+      return;
+    }
+    try {
+      const res = await fetch(`${input.dataset.suggestUrl}?q=${encodeURIComponent(q)}`);
+      if (!res.ok || request !== latest) return;  // a newer keystroke won
+      const data = await res.json();
+      list.replaceChildren(
+        ...data.suggestions.map(s => {
+          const option = document.createElement("option");
+          option.value = s.text;
+          option.label = s.kind;
+          return option;
+        })
+      );
+    } catch (err) {
+      // suggestions are optional; the search form works without them
+    }
+  });
+}
+
 // ---------- BOOTSTRAP ON PAGE LOAD ----------
 document.addEventListener("DOMContentLoaded", () => {
   mirrorRegisterToLocalStorage();
   mirrorLoginToLocalStorage();
+  attachSearchSuggestions();
 });
@@ -0,0 +1,44 @@
+"""Shared fixtures: one storefront app over a scratch copy of the shipped data.
+
+The app reads its settings at import, so the environment is set up here,
+before any test imports it. The data directory starts with only the
+pre-split store.db, the way a fresh checkout does; migrations build the
+three split databases from it on first use.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = tempfile.mkdtemp(prefix="valley-tests-")
+shutil.copy(os.path.join(ROOT, "store.db"), DATA_DIR)
+
+os.environ.update(
+    VALLEY_DATA_DIR=DATA_DIR,
+    CATALOG_CHECK_INTERVAL="0",
+    HASH_WORKERS="0",
+    PROFILE_SAMPLE_RATE="0",
+    SLOW_REQUEST_MS="0",
+    AUTH_ATTEMPTS_PER_USER="0",
+    STRIPE_SECRET_KEY="sk_test_tests",
+    STRIPE_WEBHOOK_SECRET="whsec_tests",
+)
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope="session")
+def storefront():
+    import app
+
+    app.ensure_schema()
+    yield app
+    shutil.rmtree(DATA_DIR, ignore_errors=True)
+
+
+@pytest.fixture
+def client(storefront):
+    return storefront.app.test_client()
@@ -0,0 +1,30 @@
+import time
+
+
+def test_typo_search_on_cold_worker_is_not_cached_empty(storefront, client, monkeypatch):
+    # a worker that has not built its trigram index yet
+    monkeypatch.setattr(storefront, "fuzzy_index", storefront.TrigramIndex())
+    storefront.shop_page_cache.clear()
+
+    client.get("/?q=altenator")
+    with storefront.app.app_context():
+        storefront.fuzzy_index.refresh(wait=True)
+
+    page = client.get("/?q=altenator")
+    assert page.status_code == 200
+    assert b"110A Alternator" in page.data
+
+
+def test_first_suggest_on_cold_worker_has_results(storefront, client, monkeypatch):
+    build = storefront.SuggestIndex.build
+
+    def slow_build(self, products):
+        # as on a real catalog, the build outlasts the request that needs it
+        time.sleep(0.3)
+        build(self, products)
+
+    monkeypatch.setattr(storefront.SuggestIndex, "build", slow_build)
+    monkeypatch.setattr(storefront, "suggest_index", storefront.SuggestIndex())
+
+    suggestions = client.get("/api/suggest?q=alter").get_json()["suggestions"]
+    assert {"text": "110A Alternator", "kind": "part"} in suggestions
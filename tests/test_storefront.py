@@ -0,0 +1,141 @@
+import json
+import sqlite3
+import threading
+
+import pytest
+
+from conftest import ROOT
+
+
+def test_hot_path_queries_use_an_index(storefront):
+    with storefront.app.app_context():
+        plans = storefront.capture_hot_path_sql()
+    assert plans
+    scans = [
+        (name, " ".join(sql.split()), detail)
+        for name, sql, details in plans
+        for detail in details
+        if storefront.is_table_scan(sql, detail)
+    ]
+    assert scans == []
+
+
+@pytest.mark.parametrize(
+    "values, sort, expected",
+    [
+        (["Brake Pads", 54.99, "pads"], "name", ["Brake Pads", 54.99, "pads"]),
+        ([54, "Brake Pads", "pads"], "price_asc", [54, "Brake Pads", "pads"]),
+        ([54.99, "Brake Pads", "pads"], "name", None),
+        (["Brake Pads", "54.99", "pads"], "name", None),
+        (["Brake Pads", True, "pads"], "name", None),
+        (["Brake Pads", 54.99], "name", None),
+    ],
+)
+def test_decode_product_cursor(storefront, values, sort, expected):
+    token = storefront.encode_cursor(values)
+    assert storefront.decode_product_cursor(token, sort) == expected
+
+
+@pytest.mark.parametrize("token", [None, "", "not base64!", "bnVsbA"])
+def test_decode_cursor_rejects_malformed_tokens(storefront, token):
+    assert storefront.decode_cursor(token, 3) is None
+
+
+@pytest.mark.parametrize("values, expected", [([42], 42), (["42"], None), ([True], None), ([4.2], None)])
+def test_decode_order_cursor(storefront, values, expected):
+    assert storefront.decode_order_cursor(storefront.encode_cursor(values)) == expected
+
+
+def test_api_cursors_of_the_wrong_type_are_rejected(storefront, client):
+    with client.session_transaction() as session:
+        session["username"] = "cursor-test"
+    bad_product = storefront.encode_cursor(["Brake Pads", "54.99", "pads"])
+    bad_order = storefront.encode_cursor(["42"])
+
+    assert client.get(f"/api/products?cursor={bad_product}").status_code == 400
+    assert client.get(f"/api/orders?cursor={bad_order}").status_code == 400
+    # the HTML pages fall back to the first page
+    assert client.get(f"/?cursor={bad_product}").status_code == 200
+    assert client.get(f"/orders?cursor={bad_order}").status_code == 200
+
+
+def test_webhook_creates_one_order_however_often_it_is_delivered(storefront, client):
+    username = "webhook-test"
+    with storefront.app.app_context():
+        snapshot_id = storefront.create_checkout_snapshot(
+            username, storefront.price_cart({"alternator-110amp": 2})
+        )
+    event = json.dumps({
+        "id": "evt_test_1",
+        "object": "event",
+        "type": "checkout.session.completed",
+        "data": {"object": {
+            "id": "cs_test_1",
+            "object": "checkout.session",
+            "payment_status": "paid",
+            "metadata": {"username": username, "checkout_id": snapshot_id},
+        }},
+    })
+    secret = storefront.STRIPE_WEBHOOK_SECRET
+
+    forged = client.post(
+        "/stripe/webhook", data=event,
+        headers={"Stripe-Signature": storefront.sign_webhook_payload(event, "whsec_other")},
+    )
+    assert forged.status_code == 400
+    for _ in range(3):
+        response = client.post(
+            "/stripe/webhook", data=event,
+            headers={"Stripe-Signature": storefront.sign_webhook_payload(event, secret)},
+        )
+        assert response.status_code == 200
+
+    with storefront.app.app_context():
+        orders, _ = storefront.fetch_orders(username)
+    assert len(orders) == 1
+    assert orders[0]["total"] == 259.98
+
+
+def test_concurrent_cart_adds_are_not_lost(storefront):
+    username, pid = "cart-test", "spark-plug-iridium"
+
+    def add():
+        with storefront.app.app_context():
+            for _ in range(25):
+                storefront.add_item_to_cart(username, pid)
+
+    threads = [threading.Thread(target=add) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with storefront.app.app_context():
+        assert storefront.get_cart(username) == {pid: 200}
+        for _ in range(200):
+            storefront.decrement_cart_item(username, pid)
+        assert storefront.get_cart(username) == {}
+
+
+def test_migrations_move_the_shipped_store_db(storefront):
+    assert storefront.schema_versions() == storefront.SCHEMA_VERSIONS
+
+    legacy = sqlite3.connect(f"file:{ROOT}/store.db?mode=ro", uri=True)
+    try:
+        expected = {
+            "catalog": ("SELECT id, name, price FROM products", legacy.execute(
+                "SELECT id, name, price FROM products").fetchall()),
+            "users": ("SELECT username, email FROM users", legacy.execute(
+                "SELECT username, email FROM users").fetchall()),
+            "orders": ("SELECT id, username, total FROM orders WHERE username = 'jsanchez'", legacy.execute(
+                "SELECT id, username, total FROM orders").fetchall()),
+        }
+    finally:
+        legacy.close()
+
+    for name, (sql, rows) in expected.items():
+        conn = storefront.DATABASES[name].connect()
+        try:
+            assert sorted(map(tuple, conn.execute(sql))) == sorted(rows)
+        finally:
+            conn.close()